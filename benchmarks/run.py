@@ -0,0 +1,226 @@
+"""End-to-end benchmark of Thot on synthetic sites of growing size.
+
+usage:
+    python benchmarks/run.py [--sizes 1000,10000] [--templating mako]
+                             [--jobs N] [--output results.json]
+    python benchmarks/run.py --compare old.json new.json
+
+Every build runs Site.run() in a process of its own, so that its peak
+memory (RSS) is that of the build alone. Results are stored as JSON,
+along with the commit they have been measured at, for comparison.
+"""
+
+from datetime import datetime
+from optparse import OptionParser, SUPPRESS_HELP
+from os import chdir, walk
+from os.path import join, exists, getsize, dirname, abspath
+import json
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import pytz
+
+sys.path.insert(0, dirname(abspath(__file__)))
+from sitegen import generate_site # pylint: disable=wrong-import-position
+
+BENCH_DIR = dirname(abspath(__file__))
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR,
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            check=True).stdout.decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _output_size(output_dir):
+    """Returns the number of files in `output_dir` and their total size."""
+    count, size = 0, 0
+    for dirpath, _, filenames in walk(output_dir):
+        for filename in filenames:
+            count += 1
+            size += getsize(join(dirpath, filename))
+    return count, size
+
+def build_once(project_dir, jobs, gzip):
+    """
+    Builds the project at `project_dir` and returns what was measured.
+    Changes the working directory to it, as thot is run from there.
+    """
+    # pylint: disable=import-outside-toplevel
+    from thot.app import read_settings, build
+
+    # paths of static files are relative to the working directory
+    project_dir = abspath(project_dir)
+    chdir(project_dir)
+
+    settings = {
+        'project_dir': project_dir,
+        'output_dir': join(project_dir, '_output'),
+        'template_dir': join(project_dir, '_templates'),
+        'lib_dir': join(project_dir, '_lib'),
+        'url_path': join(project_dir, '_lib', 'urls.py'),
+        'settings_path': join(project_dir, '_config.yml'),
+        'manifest_path': join(project_dir, '_lib', 'build_manifest.pickle'),
+        'hardlinks': False,
+        'jobs': jobs,
+        'make_compressed_copy': gzip,
+        'compress_if_ending': ['.css', '.js', '.xml', '.json'],
+        'timings': join(project_dir, '_lib', 'timings.json'),
+        'build_tz': pytz.utc,
+        'build_time': pytz.utc.localize(datetime.utcnow()),
+    }
+    read_settings(settings)
+    start = time.perf_counter()
+    site = build(settings)
+    seconds = time.perf_counter() - start
+
+    page_count = len(site.pages)
+    stages = [{'name': name, 'wall': wall, 'cpu': cpu,
+               'pages_per_s': page_count / wall if wall else None}
+              for name, wall, cpu in site.timings.stages]
+    output_files, output_bytes = _output_size(settings['output_dir'])
+    return {
+        'pages': page_count,
+        'seconds': seconds,
+        'pages_per_s': page_count / seconds,
+        'stages': stages,
+        'plugins': site.timings.as_dict()['plugins'],
+        # in KiB on Linux
+        'peak_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'peak_rss_workers':
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+        'output_files': output_files,
+        'output_bytes': output_bytes,
+    }
+
+def run_size(workdir, size, templating_engine, jobs, gzip, repeat):
+    """
+    Generates a project of `size` pages unless it exists,
+    builds it `repeat` times, and returns the fastest run.
+    """
+    project_dir = join(workdir, 'site-%d-%s' % (size, templating_engine))
+    if not exists(project_dir):
+        start = time.perf_counter()
+        generate_site(project_dir, size, templating_engine)
+        print('Generated %s in %.1f seconds.' % (
+            project_dir, time.perf_counter() - start))
+    runs = []
+    for _ in range(repeat):
+        with tempfile.NamedTemporaryFile(suffix='.json') as result:
+            subprocess.run(
+                [sys.executable, __file__, '--build', project_dir,
+                 '--jobs', str(jobs), '--result', result.name]
+                + (['--gzip'] if gzip else []),
+                stdout=subprocess.DEVNULL, check=True)
+            runs.append(json.load(result))
+    best = min(runs, key=lambda r: r['seconds'])
+    best.update(size=size, templating_engine=templating_engine, jobs=jobs,
+                gzip=gzip, repeat=repeat)
+    return best
+
+def compare(old_path, new_path):
+    """Prints how the results in `new_path` differ from those in `old_path`."""
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print('%s (%s) -> %s (%s)' % (old_path, old.get('commit'),
+                                  new_path, new.get('commit')))
+    old_runs = {(r['size'], r['templating_engine'], r['jobs']): r
+                for r in old['runs']}
+    for run in new['runs']:
+        key = (run['size'], run['templating_engine'], run['jobs'])
+        if key not in old_runs:
+            continue
+        before = old_runs[key]
+        print('%d pages, %s, %d jobs:' % key)
+        old_stages = {stage['name']: stage for stage in before['stages']}
+        rows = [('total', before['seconds'], run['seconds'])]
+        rows += [(stage['name'], old_stages[stage['name']]['wall'],
+                  stage['wall'])
+                 for stage in run['stages'] if stage['name'] in old_stages]
+        for name, old_wall, new_wall in rows:
+            print('  %-26s %9.3f s %9.3f s %+7.1f%%' % (
+                name, old_wall, new_wall,
+                (new_wall / old_wall - 1) * 100 if old_wall else 0))
+        for name in ('peak_rss', 'peak_rss_workers', 'output_bytes'):
+            print('  %-26s %11d %11d %+7.1f%%' % (
+                name, before[name], run[name],
+                (run[name] / before[name] - 1) * 100 if before[name] else 0))
+
+def main():
+    parser = OptionParser(
+        usage=__doc__.split('\n\n')[1].strip()[len('usage:'):])
+    parser.add_option(
+        '--sizes', default='1000,10000,100000',
+        help='comma-separated numbers of pages (default: 1000,10000,100000)')
+    parser.add_option(
+        '-t', '--templating', default='mako', dest='templating_engine',
+        help='quickstart templates to use, "mako" (default) or "jinja2"')
+    parser.add_option(
+        '-j', '--jobs', type='int', default=1,
+        help='number of processes to build with')
+    parser.add_option(
+        '-z', '--gzip', action='store_true',
+        help='make gzip-compressed copies, too')
+    parser.add_option(
+        '--repeat', type='int', default=1, metavar='N',
+        help='build every site N times and keep the fastest run')
+    parser.add_option(
+        '--workdir', default=join(tempfile.gettempdir(), 'thot-bench'),
+        help='where to keep the generated sites (default: %default)')
+    parser.add_option(
+        '-o', '--output', metavar='FILE',
+        help='write the results to FILE (default: bench-<commit>.json)')
+    parser.add_option(
+        '--compare', action='store_true',
+        help='compare two files of results, given as arguments')
+    # used internally, to build in a process of its own
+    parser.add_option('--build', help=SUPPRESS_HELP)
+    parser.add_option('--result', help=SUPPRESS_HELP)
+    options, args = parser.parse_args()
+
+    if options.compare:
+        if len(args) != 2:
+            parser.error('--compare needs two files of results')
+        compare(*args)
+        return
+    if options.build:
+        with open(options.result, 'w') as f:
+            json.dump(build_once(options.build, options.jobs, options.gzip), f)
+        return
+
+    commit = _git_commit()
+    results = {
+        'commit': commit,
+        'date': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'runs': [],
+    }
+    for size in [int(s) for s in options.sizes.split(',')]:
+        run = run_size(options.workdir, size, options.templating_engine,
+                       options.jobs, options.gzip, options.repeat)
+        results['runs'].append(run)
+        print('%7d pages: %8.2f s, %8.1f pages/s, peak RSS %d KiB,'
+              ' %d bytes output' % (
+                  size, run['seconds'], run['pages_per_s'],
+                  max(run['peak_rss'], run['peak_rss_workers']),
+                  run['output_bytes']))
+        for stage in run['stages']:
+            print('    %-26s %8.3f s %10.1f pages/s' % (
+                stage['name'], stage['wall'], stage['pages_per_s'] or 0))
+
+    output = options.output or 'bench-%s.json' % (commit or 'unknown')
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+    print('Results have been written to %s' % output)
+
+if __name__ == '__main__':
+    main()
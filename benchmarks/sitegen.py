@@ -0,0 +1,146 @@
+"""Generator of synthetic Thot projects, for benchmarking.
+
+A project consists of the quickstart of a templating engine, and
+`pages` pages in sections of up to SECTION_SIZE pages each, written
+alternately in Markdown, reStructuredText and HTML, with tags and
+categories, and static files next to them. The same arguments always
+yield the same project.
+"""
+
+from datetime import datetime, timedelta
+from os import makedirs
+from os.path import join, exists, dirname, abspath
+from shutil import copytree
+import random
+
+import yaml
+
+__all__ = [
+    'SECTION_SIZE', 'generate_site',
+]
+
+SECTION_SIZE = 500
+FORMATS = ('md', 'rst', 'html')
+TAGS = ['tag%02d' % i for i in range(40)]
+CATEGORIES = ['category%d' % i for i in range(8)]
+WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit vestibulum'
+    ' viverra quam ultricies enim sodales vitae tempor nulla elementum'
+    ' morbi sed turpis nibh proin leo orci rutrum consectetur ullamcorper'
+    ' urna aliquam erat volutpat cursus ligula lacus quisque facilisis'
+).split()
+QUICKSTART_DIR = join(dirname(dirname(abspath(__file__))), 'src', 'quickstart')
+POST_TEMPLATE = {'mako': 'post.mak', 'jinja2': 'post.html'}
+# written once per section, and next to every tenth page
+STATIC_FILES = {
+    'style.css': 2 << 10,
+    'script.js': 8 << 10,
+    'image.png': 32 << 10,
+}
+
+def _sentence(rnd, words=12):
+    return ' '.join(rnd.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+def _paragraphs(rnd, count):
+    return [' '.join(_sentence(rnd) for _ in range(rnd.randint(3, 8)))
+            for _ in range(count)]
+
+def _body_md(rnd, title):
+    parts = ['# ' + title, '']
+    for i, paragraph in enumerate(_paragraphs(rnd, rnd.randint(3, 6))):
+        parts += ['## Part %d' % (i + 1), '', paragraph, '',
+                  '* *%s* item' % rnd.choice(WORDS),
+                  '* **%s** item' % rnd.choice(WORDS),
+                  '* [a link](http://www.example.org/%s)' % rnd.choice(WORDS),
+                  '',
+                  '    for i in range(%d):' % rnd.randint(1, 9),
+                  '        print(i)', '']
+    return '\n'.join(parts)
+
+def _body_rst(rnd, title):
+    parts = [title, '=' * len(title), '']
+    for i, paragraph in enumerate(_paragraphs(rnd, rnd.randint(3, 6))):
+        heading = 'Part %d' % (i + 1)
+        parts += [heading, '-' * len(heading), '', paragraph, '',
+                  '* *%s* item' % rnd.choice(WORDS),
+                  '* **%s** item' % rnd.choice(WORDS),
+                  '* `a link <http://www.example.org/%s>`_' % rnd.choice(WORDS),
+                  '', '::', '',
+                  '    for i in range(%d):' % rnd.randint(1, 9),
+                  '        print(i)', '']
+    return '\n'.join(parts)
+
+def _body_html(rnd, title):
+    parts = ['<h1>%s</h1>' % title]
+    for i, paragraph in enumerate(_paragraphs(rnd, rnd.randint(3, 6))):
+        parts += ['<h2>Part %d</h2>' % (i + 1), '<p>%s</p>' % paragraph,
+                  '<ul><li><em>%s</em> item</li><li><a href="'
+                  'http://www.example.org/%s">a link</a></li></ul>'
+                  % (rnd.choice(WORDS), rnd.choice(WORDS)),
+                  '<pre>for i in range(%d):\n    print(i)</pre>'
+                  % rnd.randint(1, 9)]
+    return '\n'.join(parts)
+
+BODIES = {'md': _body_md, 'rst': _body_rst, 'html': _body_html}
+
+def _write_static_file(path, size, rnd):
+    if path.endswith('.png'):
+        content = bytes(rnd.getrandbits(8) for _ in range(size))
+    else:
+        content = (' '.join(rnd.choice(WORDS) for _ in range(size // 6))
+                   + '\n').encode('utf-8')[:size]
+    with open(path, 'wb') as f:
+        f.write(content)
+
+def generate_site(project_dir, pages, templating_engine='mako', seed=0):
+    """
+    Writes a project with `pages` pages to `project_dir`,
+    which must not exist yet, and returns the number of files written.
+    """
+    rnd = random.Random('%s:%s' % (seed, pages))
+    copytree(join(QUICKSTART_DIR, templating_engine), project_dir)
+    with open(join(project_dir, '_config.yml'), 'w') as f:
+        yaml.dump({'thot': {
+            'website_url': 'http://www.example.org',
+            'timezone': 'UTC',
+            'templating_engine': templating_engine,
+            'source': 'filesystem',
+            'author': {'name': 'Bench Mark', 'email': 'bench@localhost'},
+            'page_defaults': {'language': 'en'},
+        }}, f, default_flow_style=False)
+    makedirs(join(project_dir, '_lib'), exist_ok=True)
+
+    first_date = datetime(2010, 1, 1, 12, 0, 0)
+    files = 0
+    for number in range(pages):
+        section_dir = join(project_dir, 'section%03d' % (number // SECTION_SIZE))
+        if not exists(section_dir):
+            makedirs(section_dir)
+            for filename, size in STATIC_FILES.items():
+                _write_static_file(join(section_dir, filename), size, rnd)
+                files += 1
+        page_format = FORMATS[number % len(FORMATS)]
+        title = 'Page %d: %s' % (number, _sentence(rnd, 4)[:-1])
+        headers = {
+            'title': title,
+            'date': first_date + timedelta(hours=number),
+            'template': POST_TEMPLATE[templating_engine],
+            'tags': rnd.sample(TAGS, rnd.randint(0, 3)),
+            'category': rnd.choice(CATEGORIES),
+        }
+        if number % 10 == 0:
+            page_dir = join(section_dir, 'page%06d' % number)
+            makedirs(page_dir)
+            _write_static_file(join(page_dir, 'figure.png'),
+                               STATIC_FILES['image.png'], rnd)
+            path = join(page_dir, 'index.%s' % page_format)
+            files += 1
+        else:
+            path = join(section_dir, 'page%06d.%s' % (number, page_format))
+        with open(path, 'w') as f:
+            f.write(yaml.dump(headers, default_flow_style=None))
+            f.write('\n')
+            f.write(BODIES[page_format](rnd, title))
+            f.write('\n')
+        files += 1
+    return files
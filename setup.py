@@ -100,6 +100,9 @@ setuptools.setup(
         'thot.sources': [
             'filesystem = thot.core:FilesystemSource',
         ],
+        'thot.html_transforms': [
+            'hyphenate = thot.plugins.HtmlPostProcessing:HtmlHyphenator',
+        ],
     },
     # pylint: disable=line-too-long
     install_requires = [
@@ -122,6 +125,9 @@ setuptools.setup(
         'trac':   ['trac'],
         'code':   ['pygments'],
         'jinja':  ['Jinja2'],
+        'toml':   ['tomli ; python_version<"3.11"'],
+        'brotli': ['brotli'],
+        'zstd':   ['zstandard'],
     },
     classifiers=classifiers,
 )
@@ -17,7 +17,11 @@ import pytz
 import pkg_resources
 
 from thot import version
+from thot.cache import clear_caches
 from thot.core import Site
+from thot.parser import yaml_load
+from thot.publish import Generations
+from thot.serve import serve
 from thot.template import get_templating_cls
 
 try:
@@ -33,7 +37,7 @@ except ModuleNotFoundError:
         has_logformatter = False
 
 __all__ = [
-    'quickstart', 'main',
+    'quickstart', 'read_settings', 'build', 'main',
 ]
 
 LOGGING_LEVELS = {'info': logging.INFO, 'debug': logging.DEBUG}
@@ -112,6 +116,61 @@ def quickstart(settings):
     return config['thot']
 
 
+def read_settings(settings):
+    """Updates `settings` from the settings file."""
+    if exists(settings['settings_path']):
+        with codecs.open(settings['settings_path'], 'rb',
+                         encoding='utf-8') as configfile:
+            config = yaml_load(configfile.read())
+        settings.update(config['pyll'] if 'pyll' in config else config['thot'])
+    else:
+        logging.error('Not found: %s', settings['settings_path'])
+        sys.exit(1)
+    logging.debug('settings %s', settings)
+
+    # check and find the user's timezone
+    if 'timezone' not in settings:
+        settings['timezone'] = 'UTC'
+        logging.warning(
+            'No timezone has been set. Assuming all dates are in "%s".',
+            settings['timezone'])
+    elif settings['timezone'] not in pytz.all_timezones_set:
+        logging.error(  # pylint: disable=logging-not-lazy
+            'Timezone "%s" is absent from pytz.all_timezones_set.'
+            + ' Try "Europe/Berlin", "UTC" or "US/Pacific".',
+            settings['timezone'])
+        sys.exit(1)
+    settings['timezone'] = pytz.timezone(settings['timezone'])
+
+
+def build(settings):
+    """Builds the site as configured by `settings`, and returns it."""
+    # find the data source
+    for entrypoint in pkg_resources.iter_entry_points('thot.sources'):
+        if entrypoint.name == settings['source']:
+            source_cls = entrypoint.load()
+            break
+    else:
+        logging.error('Data source "%s" could not be found.',
+            settings['source'])
+        sys.exit(1)
+    # initialize site
+    source = source_cls(
+        settings['project_dir'], settings['build_time'],
+        settings['timezone'],
+        settings['default_template'] \
+            if 'default_template' in settings \
+            else get_templating_cls(settings['templating_engine'])\
+                 .default_template,
+        settings['page_defaults'] if 'page_defaults' in settings else dict(),
+        discovery_jobs=settings.get('discovery_jobs', 1),
+    )
+    site = Site(settings, source)
+
+    site.run()
+    return site
+
+
 def main():
     parser = OptionParser(version='%prog ' + version)
     parser.add_option(
@@ -125,6 +184,50 @@ def main():
         '--hardlinks', action='store_true',
         help='instead of copying static files, creates hardlinks' \
              + ' - which is faster and saves space')
+    parser.add_option(
+        '--incremental', action='store_true',
+        help='skip pages which have not changed since the last build')
+    parser.add_option(
+        '--sync', action='store_true',
+        help='update the output directory in place, writing only' \
+             + ' what has changed and removing what is gone')
+    parser.add_option(
+        '--generations', type='int', metavar='N',
+        help='build into a new generation of the output directory,' \
+             + ' switch to it atomically, and keep N previous ones')
+    parser.add_option(
+        '--rollback', action='store_true',
+        help='switch the output directory back to its previous generation')
+    parser.add_option(
+        '--serve', action='store_true',
+        help='serve the site, and rebuild it whenever something changes')
+    parser.add_option(
+        '--port', type='int', default=8000,
+        help='port to serve the site at, with --serve (default: 8000)')
+    parser.add_option(
+        '--streaming', action='store_true',
+        help='write pages as soon as they are rendered, to save memory')
+    parser.add_option(
+        '--no-cache', action='store_false', default=True, dest='use_cache',
+        help='neither use nor update the cache of parsed pages')
+    parser.add_option(
+        '--clear-cache', action='store_true',
+        help='empty all caches in "_lib/.cache" before building')
+    parser.add_option(
+        '--timings', metavar='FILE',
+        help='measure how long each stage, processor and page takes,' \
+             + ' write that to FILE as JSON and summarize it')
+    parser.add_option(
+        '--timings-top', type='int', default=10, metavar='N',
+        dest='timings_top',
+        help='number of slowest pages and processors to list (default: 10)')
+    parser.add_option(
+        '-j', '--jobs', type='int', default=1,
+        help='number of processes to parse and render pages,' \
+             + ' and to compress outputs with')
+    parser.add_option(
+        '--io-jobs', type='int', default=1, metavar='N',
+        help='number of threads to copy or link static files with')
     parser.add_option(
         '-z', '--gzip', action='store_true',
         help='make a gzip-compressed copy of rendered files')
@@ -149,7 +252,20 @@ def main():
         'lib_dir': join(project_dir, '_lib'),
         'url_path': join(project_dir, '_lib', 'urls.py'),
         'settings_path': join(project_dir, '_config.yml'),
+        'manifest_path': join(project_dir, '_lib', 'build_manifest.pickle'),
+        'asset_manifest_path': join(project_dir, '_lib',
+                                    'static_manifest.pickle'),
+        'cache_dir': join(project_dir, '_lib', '.cache'),
+        'use_cache': options.use_cache,
         'hardlinks': options.hardlinks,
+        'incremental': options.incremental,
+        'jobs': options.jobs,
+        'io_jobs': options.io_jobs,
+        'sync': options.sync,
+        'generations': options.generations,
+        'streaming': options.streaming,
+        'timings': abspath(options.timings) if options.timings else None,
+        'timings_top': options.timings_top,
         'make_compressed_copy': options.gzip,
         'compress_if_ending': GZIP_ENDINGS,
         'templating_engine': options.templating_engine,
@@ -188,53 +304,34 @@ def main():
         print('\nYour website will written to %s' % settings['output_dir'])
         sys.stdout.flush()
 
-    # read settings file
-    if exists(settings['settings_path']):
-        with codecs.open(settings['settings_path'], 'rb',
-                         encoding='utf-8') as configfile:
-            config = yaml.safe_load(configfile.read())
-        settings.update(config['pyll'] if 'pyll' in config else config['thot'])
-    else:
-        logging.error('Not found: %s', settings['settings_path'])
-        sys.exit(1)
-    logging.debug('settings %s', settings)
+    if options.serve:
+        # rebuilds are incremental and need not start from scratch
+        settings['incremental'] = settings['sync'] = True
+    cli_settings = dict(settings)
+    read_settings(settings)
+    if options.clear_cache:
+        clear_caches(settings)
 
-    # check and find the user's timezone
-    if 'timezone' not in settings:
-        settings['timezone'] = 'UTC'
-        logging.warning(
-            'No timezone has been set. Assuming all dates are in "%s".',
-            settings['timezone'])
-    elif settings['timezone'] not in pytz.all_timezones_set:
-        logging.error(  # pylint: disable=logging-not-lazy
-            'Timezone "%s" is absent from pytz.all_timezones_set.'
-            + ' Try "Europe/Berlin", "UTC" or "US/Pacific".',
-            settings['timezone'])
-        sys.exit(1)
-    settings['timezone'] = pytz.timezone(settings['timezone'])
+    if options.rollback:
+        generations = Generations(settings['output_dir'], 0)
+        previous = generations.rollback()
+        if not previous:
+            logging.error('There is no previous generation of %s.',
+                          settings['output_dir'])
+            sys.exit(1)
+        print('%s is now %s' % (settings['output_dir'], previous))
+        return
 
-    # find the data source
-    for entrypoint in pkg_resources.iter_entry_points('thot.sources'):
-        if entrypoint.name == settings['source']:
-            source_cls = entrypoint.load()
-            break
-    else:
-        logging.error('Data source "%s" could not be found.',
-            settings['source'])
-        sys.exit(1)
-    # initialize site
-    source = source_cls(
-        settings['project_dir'], settings['build_time'],
-        settings['timezone'],
-        settings['default_template'] \
-            if 'default_template' in settings \
-            else get_templating_cls(settings['templating_engine'])\
-                 .default_template,
-        settings['page_defaults'] if 'page_defaults' in settings else dict(),
-    )
-    site = Site(settings, source)
+    if options.serve:
+        def rebuild():
+            build_settings = dict(cli_settings)
+            build_settings['build_time'] = pytz.utc.localize(datetime.utcnow())
+            read_settings(build_settings)
+            build(build_settings)
+        serve(settings, rebuild, options.port)
+        return
 
-    site.run()
+    build(settings)
     if options.hardlinks:
         print('Keep in mind: Output directory contains hardlinks.')
 
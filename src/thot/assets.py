@@ -0,0 +1,194 @@
+"""Copying of static files to the output, skipping those that are current.
+
+What has been copied is recorded in a manifest, along with the stat
+results of source and copy and, once known, the digest of the content.
+A file that has not changed since then is recognised by its stat results
+alone, without reading it. Files are copied by the kernel if it can,
+as reflinks (FICLONE), by copy_file_range(2) or by sendfile(2).
+"""
+
+from os import fstat, link, lstat, makedirs, remove, replace, stat
+from os.path import dirname, exists, relpath
+import errno
+import logging
+import os
+import pickle
+import shutil
+
+from thot.utils import hash_file
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+__all__ = [
+    'clone_file', 'AssetSync',
+]
+
+# from linux/fs.h
+FICLONE = 0x40049409
+# per process, system calls found missing
+_unsupported = set()
+
+def _copy_by_kernel(fsrc, fdst, size):
+    """
+    Copies `size` bytes from file object `fsrc` to `fdst` within the kernel.
+    Returns False if that is not possible, in which case nothing has been
+    written.
+    """
+    src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+    if fcntl and 'ficlone' not in _unsupported:
+        try:
+            fcntl.ioctl(dst_fd, FICLONE, src_fd)
+            return True
+        except OSError as e:
+            if e.errno == errno.ENOSYS:
+                _unsupported.add('ficlone')
+    for name in ('copy_file_range', 'sendfile'):
+        if name in _unsupported or not hasattr(os, name):
+            continue
+        copy = getattr(os, name)
+        offset = 0
+        try:
+            while offset < size:
+                if name == 'sendfile':
+                    sent = copy(dst_fd, src_fd, offset, size - offset)
+                else:
+                    sent = copy(src_fd, dst_fd, size - offset,
+                                offset, offset)
+                if sent == 0:
+                    break
+                offset += sent
+        except OSError as e:
+            if offset > 0:
+                raise
+            if e.errno == errno.ENOSYS:
+                _unsupported.add(name)
+            continue
+        if offset == size:
+            return True
+        if offset > 0:
+            # the source has shrunk meanwhile
+            fdst.truncate(offset)
+            return True
+    return False
+
+def clone_file(src, dst):
+    """
+    Copies `src` to `dst` with its permissions and times, as shutil.copy2()
+    does, but lets the kernel share or copy the content where it can.
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        if not _copy_by_kernel(fsrc, fdst, fstat(fsrc.fileno()).st_size):
+            shutil.copyfileobj(fsrc, fdst, 1 << 20)
+    shutil.copystat(src, dst)
+
+def _signature(st):
+    return (st.st_size, st.st_mtime_ns, st.st_ino)
+
+
+class AssetSync(object):
+    """
+    Copies (or links) static files to `output_dir`, unless their copies
+    there are current, as told by the manifest at `path`.
+
+    Entries in the manifest are by output path, relative to `output_dir`:
+    (source path, signature of source, signature of copy, digest or None),
+    with signatures being (size, mtime_ns, inode).
+    """
+
+    def __init__(self, path, output_dir, hardlinks=False):
+        self.path = path
+        self.output_dir = output_dir
+        self.hardlinks = hardlinks
+        self.entries = {}
+        self.new_entries = {}
+        self.unlinked = []  # those copied because they could not be linked
+        self._made_dirs = set()
+
+    def load(self):
+        """Reads the manifest, if there is one."""
+        if not self.path or not exists(self.path):
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                self.entries = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            logging.warning('Ignoring unreadable manifest of static files'
+                            ' "%s": %s', self.path, e)
+
+    def save(self):
+        """Writes the manifest, with the files synced since load()."""
+        if not self.path:
+            return
+        with open(self.path + '.tmp', 'wb') as f:
+            pickle.dump(self.new_entries, f, pickle.HIGHEST_PROTOCOL)
+        replace(self.path + '.tmp', self.path)
+
+    def _makedirs(self, directory):
+        if directory not in self._made_dirs:
+            makedirs(directory, exist_ok=True)
+            self._made_dirs.add(directory)
+
+    @staticmethod
+    def _is_current(src, src_st, dst, dst_st, entry):
+        """
+        True if `dst`, with stat result `dst_st`, is a copy of `src`,
+        and the digest of its content if known.
+        """
+        if src_st.st_dev == dst_st.st_dev and src_st.st_ino == dst_st.st_ino:
+            return True, entry[3] if entry else None
+        if src_st.st_size != dst_st.st_size:
+            return False, None
+        if entry and entry[0] == src and entry[2] == _signature(dst_st):
+            # the copy is as it has been left, so compare with what it was
+            if entry[1] == _signature(src_st):
+                return True, entry[3]
+            digest = hash_file(src)
+            return digest == (entry[3] or hash_file(dst)), digest
+        # a copy made by clone_file() retains size and mtime
+        if src_st.st_mtime_ns == dst_st.st_mtime_ns:
+            return True, None
+        digest = hash_file(src)
+        return digest == hash_file(dst), digest
+
+    def sync(self, src, dst):
+        """
+        Copies `src` to `dst`, unless that is current already.
+
+        Returns True if it has been copied, and False if it was current.
+        Raises OSError if it could not be copied. Can be called by any
+        number of threads at once, for different `dst`.
+        """
+        key = relpath(dst, self.output_dir)
+        entry = self.entries.get(key)
+        src_st = stat(src)
+        try:
+            dst_st = lstat(dst)
+        except OSError:
+            dst_st = None
+
+        if dst_st is None:
+            self._makedirs(dirname(dst))
+        else:
+            is_current, digest = self._is_current(src, src_st, dst, dst_st,
+                                                  entry)
+            if is_current:
+                self.new_entries[key] = (src, _signature(src_st),
+                                         _signature(dst_st), digest)
+                return False
+            # Don't write into `dst`, which can be a hardlink to another file.
+            remove(dst)
+        copied = False
+        if self.hardlinks:
+            try:
+                link(src, dst)
+                copied = True
+            except OSError:
+                self.unlinked.append(dst)
+        if not copied:
+            clone_file(src, dst)
+        self.new_entries[key] = (src, _signature(src_st),
+                                 _signature(lstat(dst)), None)
+        return True
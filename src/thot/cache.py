@@ -0,0 +1,132 @@
+"""Caches that persist across builds, kept below "_lib/.cache".
+
+Entries are files named after the digest of whatever went into them,
+hence never need to be invalidated, only evicted once the cache has
+grown too large. Any number of processes can use a cache at once.
+"""
+
+from os import makedirs, remove, replace, scandir, utime, getpid
+from os.path import join, isdir
+from shutil import rmtree
+import logging
+
+__all__ = [
+    'FileCache', 'named_cache', 'parse_cache', 'trim_caches', 'clear_caches',
+]
+
+class FileCache(object):
+    """
+    Maps hex digests to bytes, stored in files below `directory`.
+
+    Entries that are read get touched, so that trim() evicts
+    the least recently used ones first.
+    """
+
+    def __init__(self, directory, max_size):
+        self.directory = directory
+        self.max_size = max_size
+
+    def _path(self, key):
+        return join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """Returns the bytes stored under `key`, or None."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+            utime(path)
+        except OSError:
+            return None
+        return value
+
+    def touch(self, key):
+        """
+        Marks the entry `key` as recently used
+        and returns its path, or None if there is none.
+        """
+        path = self._path(key)
+        try:
+            utime(path)
+        except OSError:
+            return None
+        return path
+
+    def put(self, key, value):
+        """Stores bytes `value` under `key`."""
+        path = self._path(key)
+        tmp_path = '%s.%d.tmp' % (path, getpid())
+        try:
+            makedirs(join(self.directory, key[:2]), exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                f.write(value)
+            replace(tmp_path, path)
+        except OSError as e:
+            logging.debug('cannot cache %s: %s', path, e)
+
+    def trim(self):
+        """Removes least recently used entries until `max_size` is met."""
+        if not isdir(self.directory):
+            return
+        entries, size = [], 0
+        for subdir in scandir(self.directory):
+            if not subdir.is_dir():
+                continue
+            for entry in scandir(subdir.path):
+                st = entry.stat()
+                entries.append((st.st_mtime_ns, st.st_size, entry.path))
+                size += st.st_size
+        if size <= self.max_size:
+            return
+        entries.sort()
+        for _, entry_size, path in entries:
+            if size <= self.max_size:
+                break
+            try:
+                remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+        logging.debug('trimmed %s to %d bytes', self.directory, size)
+
+
+# directory below "cache_dir" -> setting with its size, and its default
+CACHES = {
+    'parsed': ('parse_cache_size', 256 << 20),
+    'math': ('math_cache_size', 64 << 20),
+    'highlighted': ('highlight_cache_size', 64 << 20),
+    'compressed': ('compress_cache_size', 256 << 20),
+}
+
+# per process, by directory
+_caches = {}
+
+def named_cache(settings, name):
+    """
+    The cache `name` (any of CACHES) below setting "cache_dir",
+    or None if caches are not to be used.
+    """
+    if not settings.get('use_cache') or 'cache_dir' not in settings:
+        return None
+    directory = join(settings['cache_dir'], name)
+    if directory not in _caches:
+        size_setting, default_size = CACHES[name]
+        _caches[directory] = FileCache(
+            directory, settings.get(size_setting, default_size))
+    return _caches[directory]
+
+def parse_cache(settings):
+    """The cache of parsed pages, or None."""
+    return named_cache(settings, 'parsed')
+
+def trim_caches(settings):
+    """Evicts entries from all caches which have grown too large."""
+    for name in CACHES:
+        cache = named_cache(settings, name)
+        if cache:
+            cache.trim()
+
+def clear_caches(settings):
+    """Removes all caches."""
+    if isdir(settings['cache_dir']):
+        rmtree(settings['cache_dir'])
@@ -0,0 +1,108 @@
+"""Precompressed copies of outputs, for webservers that serve those.
+
+Every output can get a copy per format next to it: "<output>.gz",
+"<output>.br" (needs package brotli) and "<output>.zst" (needs package
+zstandard). Copies are kept in cache "compressed" by the digest of what
+has been compressed, so that unchanged outputs aren't compressed again.
+"""
+
+from os import remove, stat, utime
+from os.path import exists
+import gzip
+import hashlib
+import logging
+
+__all__ = [
+    'FORMATS', 'DEFAULT_LEVELS', 'COMPRESSORS',
+    'compression_formats', 'compress_file',
+]
+
+# all formats, by the extension of their files
+FORMATS = ('gz', 'br', 'zst')
+DEFAULT_LEVELS = {'gz': 9, 'br': 11, 'zst': 19}
+
+def _gzip(data, level, mtime):
+    return gzip.compress(data, compresslevel=level, mtime=mtime)
+
+# by extension: functions of (data, level, mtime) to the compressed data
+COMPRESSORS = {'gz': _gzip}
+
+try:
+    import brotli
+    COMPRESSORS['br'] = lambda data, level, mtime: \
+        brotli.compress(data, quality=level)
+except ModuleNotFoundError:
+    pass
+
+try:
+    import zstandard
+    COMPRESSORS['zst'] = lambda data, level, mtime: \
+        zstandard.ZstdCompressor(level=level).compress(data)
+except ModuleNotFoundError:
+    pass
+
+def compression_formats(settings):
+    """
+    Returns a list of (extension, level) of the formats named
+    in setting "compress_formats", with levels from "compress_levels".
+    """
+    formats = []
+    levels = settings.get('compress_levels') or {}
+    for ext in settings.get('compress_formats') or ['gz']:
+        if ext not in FORMATS:
+            logging.error('Unknown compression format "%s", use any of %s.',
+                          ext, ', '.join(FORMATS))
+        elif ext not in COMPRESSORS:
+            logging.error('Compression format "%s" needs package "%s".',
+                          ext, {'br': 'brotli', 'zst': 'zstandard'}[ext])
+        else:
+            formats.append((ext, int(levels.get(ext, DEFAULT_LEVELS[ext]))))
+    return formats
+
+def compress_file(path, formats, min_size=0, min_gain=0, cache=None):
+    """
+    Writes a copy of the file at `path` for every (extension, level)
+    in `formats` next to it, with the same times.
+
+    No copy is made if the file is smaller than `min_size` bytes, or if
+    the copy is not at least `min_gain` percent smaller. Copies, and that
+    there is none, are taken from `cache` (a thot.cache.FileCache), if given.
+
+    Returns the paths of the copies that have been written.
+    Stale copies of formats that are not written get removed.
+    """
+    st = stat(path)
+    written = []
+    data = None
+    if st.st_size >= min_size:
+        with open(path, 'rb') as f:
+            data = f.read()
+    digest = hashlib.sha1(data).hexdigest() if cache and data else None
+    mtime = int(st.st_mtime)
+    for ext, level in formats:
+        copy_path = path + '.' + ext
+        compressed = None
+        if data is not None:
+            # gzip records the time in the file
+            key = hashlib.sha1(('%s:%d:%s:%s' % (
+                ext, level, mtime if ext == 'gz' else '', digest))\
+                .encode('utf-8')).hexdigest() if digest else None
+            compressed = cache.get(key) if key else None
+            if compressed is None:
+                compressed = COMPRESSORS[ext](data, level, mtime)
+                if min_gain and \
+                   len(compressed) > len(data) * (100 - min_gain) / 100:
+                    # remembered as not worth it
+                    compressed = b''
+                if key:
+                    cache.put(key, compressed)
+        # replace instead of overwrite, for the file can be a hardlink
+        if exists(copy_path):
+            remove(copy_path)
+        if not compressed:
+            continue
+        with open(copy_path, 'wb') as f:
+            f.write(compressed)
+        utime(copy_path, ns=(st.st_atime_ns, st.st_mtime_ns))
+        written.append(copy_path)
+    return written
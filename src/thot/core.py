@@ -2,16 +2,20 @@
 """
 
 from collections import OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime
+from functools import partial
 from operator import itemgetter
-from os import makedirs, utime
+from os import makedirs, utime, remove, rmdir, listdir, walk
 from os.path import splitext, join, dirname, split, getmtime, \
-                    basename, exists, relpath, isabs, isfile
-from shutil import rmtree, copystat
+                    basename, exists, relpath, isabs, isfile, isdir
+from shutil import rmtree
 import codecs
-import gzip
 import imp
 import logging
+import multiprocessing
+import pickle
 import sys
 import time
 import weakref
@@ -20,24 +24,114 @@ import pkg_resources
 import pytz
 
 from thot import parser, version as thot_version
+from thot.assets import AssetSync
+from thot.cache import named_cache, parse_cache, trim_caches
+from thot.compress import FORMATS as COMPRESSION_FORMATS, \
+    compression_formats, compress_file
+from thot.discovery import IGNORE_FILE, IgnoreMatcher, scan_tree
+from thot.latex import default_math_url, external_math_images
+from thot.manifest import BuildManifest
+from thot.publish import Generations
 from thot.template import TemplateException, get_templating_cls
+from thot.timings import Timings
 from thot.url import get_url
-from thot.utils import copy_file, walk_ignore
+from thot.utils import file_has_content
 
 __all__ = [
     'Page', 'Site', 'FilesystemSource',
 ]
 
-class Page(dict):
+# shared by all pages that have no defaults, or no static files
+EMPTY_DEFAULTS = {}
+NO_STATIC_FILES = ()
+
+class Page(MutableMapping):
     """
     Page represents the lifecycle of a webpage.
+
+    Behaves like a dict of its headers. Those every page has are kept in
+    slots, any others in a dict of their own. Defaults are shared with
+    other pages until they get overwritten.
     """
 
+    # keys that are stored as members
+    header_keys = (
+        'path', 'url', 'title', 'date', 'mtime', 'status', 'slug',
+        'template', 'output_ext', 'static_files', 'content', 'output_path',
+    )
+    header_slots = frozenset(header_keys)
+    # values of these are interned, for they repeat across pages
+    interned_headers = frozenset(['status', 'template', 'output_ext'])
+
+    __slots__ = header_keys + (
+        'db', 'get_url', 'parser_cls', 'parser_inst', 'text_offset',
+        'is_cached', '_headers', '_defaults',
+    )
+
     def __init__(self, db, get_url_fn, **kwargs):
-        super().__init__(self, **kwargs)
         self.db = db
         self.get_url = get_url_fn
         self.parser_cls = None
+        self.is_cached = False
+        self._headers = {}
+        self._defaults = EMPTY_DEFAULTS
+        self.update(kwargs)
+
+    def use_defaults(self, defaults):
+        """Falls back to `defaults` (shared, not copied) for absent keys."""
+        self._defaults = defaults
+
+    def __getitem__(self, key):
+        if key in Page.header_slots:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        try:
+            return self._headers[key]
+        except KeyError:
+            return self._defaults[key]
+
+    def __setitem__(self, key, value):
+        if key in Page.header_slots:
+            if key in Page.interned_headers and isinstance(value, str):
+                value = sys.intern(value)
+            setattr(self, key, value)
+        elif key in self._defaults and self._defaults[key] is value:
+            self._headers.pop(key, None)
+        else:
+            self._headers[key] = value
+
+    def __delitem__(self, key):
+        if key in Page.header_slots:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+            return
+        if key in self._defaults:
+            self._headers.pop(key, None)
+            self._defaults = {k: v for k, v in self._defaults.items()
+                              if k != key}
+        else:
+            del self._headers[key]
+
+    def __contains__(self, key):
+        if key in Page.header_slots:
+            return hasattr(self, key)
+        return key in self._headers or key in self._defaults
+
+    def __iter__(self):
+        for key in Page.header_keys:
+            if hasattr(self, key):
+                yield key
+        yield from self._headers
+        for key in self._defaults:
+            if key not in self._headers:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
 
     @property
     def is_public(self):
@@ -48,6 +142,17 @@ class Page(dict):
     def is_parsed(self):
         return 'content' in self
 
+    @property
+    def is_aggregate(self):
+        """
+        True if the page lists or includes other pages, as header
+        "aggregate" tells, else if it is likely to.
+        """
+        if 'aggregate' in self:
+            return bool(self['aggregate'])
+        return self['template'] == 'self' \
+            or 'index' in self or 'params' in self
+
     def dont_render(self, now):
         """True if the page shall be excluded from being rendered."""
         # skip drafts
@@ -71,9 +176,20 @@ class Page(dict):
         return self.parser_cls
 
     def load(self, site_settings):
-        raw = self.db.read(self['path'])
+        """
+        Prepares the page for parsing. Its text is read
+        only once needed, if the data source supports that.
+        """
         parser_cls = self.get_parser_class()
-        self.parser_inst = parser_cls(site_settings, raw, self['path'])
+        header_raw = None
+        if hasattr(self.db, 'read_header'):
+            header_raw, self.text_offset = self.db.read_header(self['path'])
+        if header_raw is None:
+            raw = self.db.read(self['path'])
+            self.parser_inst = parser_cls(site_settings, raw, self['path'])
+        else:
+            self.parser_inst = parser_cls(site_settings, None, self['path'],
+                                          header_raw=header_raw)
         if parser_cls.output_ext:
             self['output_ext'] = parser_cls.output_ext
 
@@ -82,13 +198,44 @@ class Page(dict):
         # update the url
         self['url'] = self.get_url(self)
 
-    def parse(self): # throws parser.ParserException
-        _, content = self.parser_inst.parse()
+    def parse(self, cache=None): # throws parser.ParserException
+        """
+        Parses the page's text, or takes the outcome from `cache`
+        if the same text has been parsed before, and the files
+        it includes have not changed since.
+        """
+        if self.parser_inst.source is None:
+            self.parser_inst.text = \
+                self.db.read_text(self['path'], self.text_offset)
+        key = self.parser_inst.cache_key() if cache else None
+        cached = cache.get(key) if key else None
+        if cached is not None:
+            cached = parser.unpack_parsed(cached)
+        if cached is not None:
+            content, self.parser_inst.dependencies = cached
+        else:
+            _, content = self.parser_inst.parse()
+            if key and not self.parser_inst.is_transient:
+                cache.put(key, parser.pack_parsed(
+                    content, self.parser_inst.dependencies))
         # update the values in the page dict
         self['content'] = content
 
+    def own_headers(self):
+        """
+        The page's headers as plain dict,
+        omitting defaults and its static files.
+        """
+        headers = {key: getattr(self, key) for key in Page.header_keys
+                   if key != 'static_files' and hasattr(self, key)}
+        headers.update(self._headers)
+        return headers
+
     def copy(self):
-        clone = Page(self.db, self.get_url, **dict(self))
+        clone = Page(self.db, self.get_url, **self.own_headers())
+        clone.use_defaults(self._defaults)
+        if 'static_files' in self:
+            clone['static_files'] = self['static_files']
         return clone
 
     def __str__(self):
@@ -105,6 +252,103 @@ class Page(dict):
         return str(self)
 
 
+def load_page(page, settings, before_parsing=None):
+    """
+    Runs those steps of the lifecycle of `page`
+    which don't depend on any other page.
+    `before_parsing` is called with the page right before it gets parsed.
+
+    Returns None if the page is not to be rendered, else a tuple of
+    its headers, its content, any parser.ParserException, and what the
+    build manifest is to record of it: its headers as they have been
+    before `before_parsing` (pickled), and the files it has read besides
+    its source (as parser.sign_dependencies() makes them). The latter is
+    None if there is no manifest, or if the outcome is not to be kept.
+    """
+    page.load(settings)
+    page.parse_headers()
+    if page.dont_render(settings['build_time']):
+        return None
+
+    # restored pages are passed to `before_parsing` again
+    pristine = pickle.dumps(page.own_headers(), pickle.HIGHEST_PROTOCOL) \
+        if settings.get('incremental') else None
+    if before_parsing:
+        # for example, load comments from a webservice or different file
+        before_parsing(page)
+
+    content, parser_error = None, None
+    try:
+        page.parse(parse_cache(settings))
+        content = page.pop('content')
+    except parser.ParserException as e:
+        parser_error = e
+    record = None
+    if pristine is not None and not page.parser_inst.is_transient:
+        record = (pristine,
+                  parser.sign_dependencies(page.parser_inst.dependencies))
+    # the parser holds the raw source, which is not needed any longer
+    del page.parser_inst
+    return page.own_headers(), content, parser_error, record
+
+# set in worker processes by _init_worker
+_worker_settings = None
+_worker_source = None
+
+def _import_urls(url_path):
+    """Imports custom url rules, which register themselves with thot.url."""
+    try:
+        imp.load_source('urls', url_path)
+    except IOError as e:
+        logging.debug('couldn\'t load urls from "%s": %s', url_path, e)
+
+def _init_worker(settings, data_source):
+    global _worker_settings, _worker_source # pylint: disable=global-statement
+    _worker_settings = settings
+    _worker_source = data_source
+    if multiprocessing.get_start_method() != 'fork':
+        _import_urls(settings['url_path'])
+
+def _load_page_in_worker(headers, static_files):
+    """
+    Returns the outcome of load_page(), and Timings of it if enabled.
+    Processors for step "before_page_parsing" are those of the site the
+    worker has been forked from, if any.
+    """
+    page = Page(_worker_source, _worker_source.get_url, **headers)
+    page.use_defaults(_worker_source.page_defaults)
+    page['static_files'] = static_files
+    timings = Timings(bool(_worker_settings.get('timings')))
+    before_parsing = None
+    if _worker_site is not None:
+        _worker_site.timings = timings
+        # pylint: disable=protected-access
+        before_parsing = _worker_site._before_page_parsing
+    with timings.page(headers['path'], 'parse'):
+        outcome = load_page(page, _worker_settings, before_parsing)
+    return outcome, (timings if timings.enabled else None)
+
+# set in forked worker processes that parse or render pages
+_worker_site = None
+
+def _render_page_in_worker(index):
+    """
+    Renders the page at `index` of the worker's copy of the site.
+
+    Returns the members of the page that have been changed or added,
+    or None if the page could not be rendered, and Timings if enabled.
+    """
+    page = _worker_site.pages[index]
+    before = dict(page)
+    timings = _worker_site.timings = Timings(_worker_site.timings.enabled)
+    # pylint: disable=protected-access
+    if not _worker_site._render_page(page):
+        return None, (timings if timings.enabled else None)
+    return {key: value for key, value in page.items()
+            if key not in before or before[key] is not value}, \
+           (timings if timings.enabled else None)
+
+
 class Site(object):
     """
     Site represents a collection of pages, i. e. usually an entire blog.
@@ -115,17 +359,29 @@ class Site(object):
         self.data_source = data_source
         self.pages = []
         self.static_files = []
+        self.public_pages = []
+        self.output_files = set()
+        self.math_images = {}   # file name -> path in the cache
+        self.manifest = None
+        self.assets = None
+        # (extension, level) of the compressed copies of outputs
+        self.compression_formats = compression_formats(settings) \
+            if settings.get('make_compressed_copy') else []
+        self.compression_tasks = []  # (path, formats)
+        # templates of pages which list other pages
+        self.aggregate_templates = frozenset(
+            settings.get('aggregate_templates') or ())
+        self.static_outputs = []
+        self.templating_engine = None
+        self.timings = Timings(bool(settings.get('timings')))
 
-        # import custom urls
-        try:
-            imp.load_source('urls', self.settings['url_path'])
-        except IOError as e:
-            logging.debug('couldn\'t load urls from "%s": %s',
-                          self.settings['url_path'], e)
+        _import_urls(self.settings['url_path'])
         self.data_source.set_urlfunc(get_url)
 
         # maps list of Processors to steps
         self.processor_map = {}
+        # entry point names of the Processors, by their id()
+        self.processor_names = {}
         self._init_processors()
 
     def _init_processors(self):
@@ -136,6 +392,7 @@ class Site(object):
             try:
                 cls = entrypoint.load()
                 cls_instance = cls(weakref.ref(self), self.settings)
+                self.processor_names[id(cls_instance)] = entrypoint.name
                 for step in cls.run_at:
                     if step in self.processor_map:
                         self.processor_map[step].append(cls_instance)
@@ -153,46 +410,174 @@ class Site(object):
         else:
             return []
 
+    def _run_processors(self, step, *args):
+        """Passes `args` to all processors for the given step."""
+        for proc in self.processors_for(step):
+            with self.timings.plugin('%s.%s' % (
+                    self.processor_names.get(id(proc), proc), step)):
+                getattr(proc, step)(*args)
+
+    def _before_page_parsing(self, page):
+        """Runs the processors for step "before_page_parsing" on `page`."""
+        self._run_processors('before_page_parsing', page)
+
+    def _parses_in_parallel(self, count):
+        """
+        True if `count` pages are to be parsed by worker processes.
+
+        Processors for step "before_page_parsing" run in these, too,
+        which needs them forked, and the processors not to have declared
+        themselves unsafe for it by a member "parallel_safe = False".
+        """
+        jobs = self.settings.get('jobs') or 1
+        if jobs <= 1 or count < 2:
+            return False
+        processors = self.processors_for('before_page_parsing')
+        if processors \
+           and 'fork' not in multiprocessing.get_all_start_methods():
+            logging.debug('Parsing serially, for processors cannot be'
+                          ' handed to worker processes.')
+            return False
+        for proc in processors:
+            if not getattr(proc, 'parallel_safe', True):
+                logging.debug('Parsing serially for the sake of %s.', proc)
+                return False
+        return True
+
+    def _load_pages(self, pages):
+        """
+        Yields the outcome of load_page() for every page, in order.
+
+        With setting "jobs" above one the pages are loaded and parsed
+        by as many worker processes.
+        """
+        before_parsing = self._before_page_parsing \
+            if self.processors_for('before_page_parsing') else None
+        if not self._parses_in_parallel(len(pages)):
+            for page in pages:
+                with self.timings.page(page['path'], 'parse'):
+                    outcome = load_page(page, self.settings, before_parsing)
+                yield outcome
+            return
+
+        jobs = self.settings['jobs']
+        if 'fork' in multiprocessing.get_all_start_methods():
+            mp_context = multiprocessing.get_context('fork')
+        else:
+            mp_context = None
+        # Workers are forked with the processors in place.
+        global _worker_site # pylint: disable=global-statement
+        _worker_site = self if before_parsing else None
+        chunksize = max(1, min(64, len(pages) // (jobs * 4)))
+        try:
+            with ProcessPoolExecutor(jobs, mp_context=mp_context,
+                                     initializer=_init_worker,
+                                     initargs=(self.settings,
+                                               self.data_source)
+                                    ) as executor:
+                for outcome, timings in executor.map(
+                        _load_page_in_worker,
+                        [page.own_headers() for page in pages],
+                        # processors such as 'comments_from_files' read them
+                        [page['static_files'] if before_parsing
+                         else NO_STATIC_FILES for page in pages],
+                        chunksize=chunksize):
+                    if timings is not None:
+                        self.timings.merge(timings)
+                    yield outcome
+        finally:
+            _worker_site = None
+
     def _parse(self, input_data):
         """Parses the input data."""
         now = self.settings['build_time']
+        pages = []
         for input_dir in input_data:
-            pages, static_files = input_data[input_dir]
+            pages_in_dir, static_files = input_data[input_dir]
 
             # special case: static files at the top level of the project dir
             # are not associated with any pages
             if input_dir == self.settings['project_dir']:
                 self.static_files = static_files
+            pages.extend(pages_in_dir)
 
+        if self.manifest:
             for page in pages:
-                page.load(self.settings)
-                page.parse_headers()
+                state = self.manifest.restore(page)
+                if state is not None:
+                    page.update(state)
+                    page.is_cached = True
+        loaded = self._load_pages([page for page in pages
+                                   if not page.is_cached])
 
+        # processors see the pages in the same order, however they were parsed
+        for page in pages:
+            if page.is_cached:
                 if page.dont_render(now):
                     continue
+                # as it would have been before parsing
+                self._before_page_parsing(page)
+            else:
+                outcome = next(loaded)
+                if outcome is None:
+                    continue
+                headers, content, parser_error, record = outcome
+                page.update(headers)
 
-                # for example, load comments from a webservice or different file
-                for proc in self.processors_for('before_page_parsing'):
-                    proc.before_page_parsing(page)
-
-                # parsing of the actual content
-                try:
-                    page.parse()
-                except parser.ParserException as parser_error:
+                if parser_error:
                     logging.error(parser_error)
                     logging.error('skipping article "%s"', page)
                     continue
+                page['content'] = content
 
-                # for example, collect tags and categories
-                for proc in self.processors_for('after_page_parsed'):
-                    proc.after_page_parsed(page)
+                if self.manifest and record is not None:
+                    self.manifest.record(page, *record)
 
-                self.pages.append(page)
-                sys.stdout.write('.')
+            # for example, collect tags and categories
+            self._run_processors('after_page_parsed', page)
+
+            self.pages.append(page)
+            sys.stdout.write('.')
         sys.stdout.write('\n')
 
-        for proc in self.processors_for('after_parsing'):
-            proc.after_parsing(self.pages)
+        self._run_processors('after_parsing', self.pages)
+
+    def _collect_math_images(self):
+        """
+        Finds the images of formulas that pages reference, rather than
+        embed, in the cache. Pages whose images have been evicted from it
+        meanwhile are parsed again, which renders them anew.
+        """
+        cache = named_cache(self.settings, 'math')
+        if cache is None or self.settings.get('math_inline_limit') is None:
+            return
+        for page in self.pages:
+            content = page['content'] if 'content' in page else None
+            if not isinstance(content, str):
+                continue
+            names = list(external_math_images(content, self.settings))
+            for attempt in (1, 2):
+                missing = []
+                for name in names:
+                    path = cache.touch(name.split('.', 1)[0])
+                    if path:
+                        self.math_images[name] = path
+                    else:
+                        missing.append(name)
+                if not missing:
+                    break
+                if attempt == 1:
+                    logging.debug('rendering the math of %s anew', page)
+                    try:
+                        page.load(self.settings)
+                        page.parse()
+                    except parser.ParserException as e:
+                        logging.error(e)
+                    del page.parser_inst
+                    page['content'] = content
+                else:
+                    logging.error('Images of formulas in %s are missing: %s',
+                                  page, ', '.join(missing))
 
     def _sort(self):
         """Sort pages by date (newest first)."""
@@ -218,121 +603,434 @@ class Site(object):
             output_path = url
         return join(self.settings['output_dir'], output_path)
 
-    def _render_pages(self):
-        public_pages = [page for page in self.pages if page.is_public]
-        templating_engine = \
-            get_templating_cls(self.settings['templating_engine'])
-        template_cls = templating_engine(self.settings)
+    def _get_templating_engine(self):
+        """Returns the templating engine, which is instantiated on first use."""
+        if self.templating_engine is None:
+            templating_cls = \
+                get_templating_cls(self.settings['templating_engine'])
+            self.templating_engine = templating_cls(self.settings)
+        return self.templating_engine
 
-        for page in self.pages:
-            if 'rendered' in page:
-                logging.warning('Skipping already rendered page %s', page)
-                continue
-            page['output_path'] = self._get_output_path(page['url'])
+    def _render_page(self, page):
+        """
+        Renders `page` and passes it to processors for step "after_rendering".
 
-            # render template
-            if page['template'] == 'self':
-                render_func = template_cls.render_string
-                template = page['content']
-            else:
-                render_func = template_cls.render_file
-                template = page['template']
+        Returns False if its template could not be rendered.
+        """
+        template_engine = self._get_templating_engine()
+        if page['template'] == 'self':
+            render_func = template_engine.render_string
+            template = page['content']
+        else:
+            render_func = template_engine.render_file
+            template = page['template']
 
-            try:
-                logging.debug('About to render "%s".', page['output_path'])
-                params = page['params'] if 'params' in page else {}
+        try:
+            logging.debug('About to render "%s".', page['output_path'])
+            params = page['params'] if 'params' in page else {}
+            with self.timings.page(page['path'], 'render'):
                 page['rendered'] = render_func(
                     template,
                     page=page,
-                    pages=public_pages,
+                    pages=self.public_pages,
                     settings=self.settings,
                     thot_version=thot_version,
                     **params)
-                assert isinstance(page['rendered'], str)
-            except TemplateException as error:
-                logging.error(error)
-                logging.error('skipping article "%s"', page['path'])
+            assert isinstance(page['rendered'], str)
+        except TemplateException as error:
+            logging.error(error)
+            logging.error('skipping article "%s"', page['path'])
+            return False
+
+        self._run_processors('after_rendering', page)
+        return True
+
+    def _renders_in_parallel(self, count):
+        """
+        True if pages are to be rendered by worker processes.
+
+        That needs 'fork' to share the parsed pages with the workers,
+        and all processors run after rendering to have not declared
+        themselves unsafe for it by a member "parallel_safe = False".
+        """
+        jobs = self.settings.get('jobs') or 1
+        if jobs <= 1 or count < 2 \
+           or 'fork' not in multiprocessing.get_all_start_methods():
+            return False
+        for proc in self.processors_for('after_rendering'):
+            if not getattr(proc, 'parallel_safe', True):
+                logging.debug('Rendering serially for the sake of %s.', proc)
+                return False
+        return True
+
+    def _render_pages(self):
+        self.public_pages = [page for page in self.pages if page.is_public]
+
+        indices = []
+        for index, page in enumerate(self.pages):
+            if 'rendered' in page:
+                logging.warning('Skipping already rendered page %s', page)
                 continue
+            page['output_path'] = self._get_output_path(page['url'])
+            if page.is_cached and not self._is_aggregate(page) \
+               and exists(page['output_path']):
+                continue
+            indices.append(index)
 
-            for proc in self.processors_for('after_rendering'):
-                proc.after_rendering(page)
+        if not self._renders_in_parallel(len(indices)):
+            for index in indices:
+                if self._render_page(self.pages[index]):
+                    self._stream(self.pages[index])
+            return
+
+        # Workers are forked with the pages in place, and
+        # return what rendering has changed of them (at least 'rendered').
+        global _worker_site # pylint: disable=global-statement
+        _worker_site = self
+        jobs = self.settings['jobs']
+        chunksize = max(1, min(16, len(indices) // (jobs * 4)))
+        with ProcessPoolExecutor(
+                jobs, mp_context=multiprocessing.get_context('fork')
+            ) as executor:
+            for index, (changes, timings) in zip(indices, executor.map(
+                    _render_page_in_worker, indices, chunksize=chunksize)):
+                if timings is not None:
+                    self.timings.merge(timings)
+                if changes is not None:
+                    self.pages[index].update(changes)
+                    self._stream(self.pages[index])
+        _worker_site = None
+
+    def _is_aggregate(self, page):
+        """
+        True if `page` lists or includes other pages, hence is to be
+        rendered after all others have changed. Besides the page itself,
+        setting "aggregate_templates" can tell so by its template.
+        """
+        return page.is_aggregate \
+            or page['template'] in self.aggregate_templates
+
+    def _stream(self, page):
+        """
+        With setting "streaming" writes a freshly rendered page right away
+        and drops its rendition, unless it is an aggregate of other pages.
+        """
+        if self.settings.get('streaming') and not self._is_aggregate(page):
+            self._write_page(page)
+            del page['rendered']
 
     def _write(self):
         """Writes the parsed data to the filesystem."""
         for page in self.pages:
-            output_path = page['output_path']
+            if 'rendered' not in page:
+                continue
+            self._write_page(page)
 
-            # create the directories for the page
-            try:
-                makedirs(dirname(output_path))
-            except OSError:
-                pass
+    def _write_page(self, page):
+        """Writes the rendered page to the filesystem."""
+        output_path = page['output_path']
+        rendered = page['rendered']
+        if isinstance(rendered, str):
+            rendered = rendered.encode('utf-8')
+
+        # create the directories for the page
+        try:
+            makedirs(dirname(output_path))
+        except OSError:
+            pass
 
-            # write to filesystem
+        # write to filesystem
+        self.output_files.add(output_path)
+        if self.settings.get('sync') \
+           and file_has_content(output_path, rendered):
+            logging.debug('%s is up to date', output_path)
+            is_written = False
+        else:
             logging.debug('writing %s to %s', page['path'], output_path)
+            # replace instead of overwrite, for the file can be a hardlink
+            if exists(output_path):
+                remove(output_path)
             with open(output_path, 'wb') as f:
-                f.write(page['rendered'])
-            page_dt_for_fs = page['mtime'].astimezone(self.settings['build_tz'])
-            atime = mtime = int(time.mktime(page_dt_for_fs.timetuple()))
-            utime(output_path, (atime, mtime))
-
-            # GZIP output for webservers which support pre-compressed files
-            if self.settings['make_compressed_copy']:
-                gz_output_path = output_path+'.gz'
-                with gzip.GzipFile(gz_output_path, 'w', mtime=mtime) as f:
-                    f.write(page['rendered'].encode('utf-8'))
-                utime(gz_output_path, (atime, mtime))
+                f.write(rendered)
+            is_written = True
+        page_dt_for_fs = page['mtime'].astimezone(self.settings['build_tz'])
+        atime = mtime = int(time.mktime(page_dt_for_fs.timetuple()))
+        utime(output_path, (atime, mtime))
 
-    def _copy_static_file(self, static_file, dst):
-        logging.debug('copying %s to %s', static_file, dst)
-        if not (copy_file(static_file, dst, self.settings['hardlinks']) \
-           and self.settings['make_compressed_copy']):
-            return
-        for ending in self.settings['compress_if_ending']:
-            if not static_file.endswith(ending):
+        # compressed copies for webservers which serve those
+        self._add_compressed_copies(output_path, not is_written)
+
+    def _add_compressed_copies(self, path, is_unchanged, skip=()):
+        """
+        Schedules the compressed copies of the output at `path`, except
+        those in `skip`. Existing ones are kept if `is_unchanged`.
+        """
+        formats = []
+        for ext, level in self.compression_formats:
+            if ext in skip:
                 continue
-            if not isfile(static_file+'.gz'):
-                with open(static_file, 'rb') as fin, \
-                        gzip.open(dst+'.gz', 'wb') as fout:
-                    fout.writelines(fin)
-                copystat(static_file, dst+'.gz')
-            break
+            if is_unchanged and isfile(path + '.' + ext):
+                self.output_files.add(path + '.' + ext)
+            else:
+                formats.append((ext, level))
+        if formats:
+            self.compression_tasks.append((path, formats))
 
-    def _copy_static_files(self):
-        """Copies static files to output directory."""
+    def _compress(self):
+        """
+        Writes the scheduled compressed copies,
+        by setting "compress_jobs" (else "jobs") processes at once.
+        """
+        tasks, self.compression_tasks = self.compression_tasks, []
+        if not tasks:
+            return
+        compress = partial(
+            compress_file,
+            min_size=self.settings.get('compress_min_size', 0),
+            min_gain=self.settings.get('compress_min_gain', 0),
+            cache=named_cache(self.settings, 'compressed'))
+        jobs = self.settings.get('compress_jobs') \
+               or self.settings.get('jobs') or 1
+        if jobs <= 1 or len(tasks) < 2:
+            results = [compress(path, formats) for path, formats in tasks]
+        else:
+            if 'fork' in multiprocessing.get_all_start_methods():
+                mp_context = multiprocessing.get_context('fork')
+            else:
+                mp_context = None
+            chunksize = max(1, min(64, len(tasks) // (jobs * 4)))
+            with ProcessPoolExecutor(jobs, mp_context=mp_context) as executor:
+                results = list(executor.map(
+                    compress, *zip(*tasks), chunksize=chunksize))
+        for written in results:
+            self.output_files.update(written)
+
+    def _copy_static_file(self, static_file, dst):
+        """
+        Copies `static_file` to `dst`. Runs in any thread;
+        returns whether it has been copied, and what went wrong if anything.
+        """
+        try:
+            return self.assets.sync(static_file, dst), None
+        except OSError as e:
+            return None, e
+
+    def _static_file_copies(self):
+        """
+        Returns a list of (static file, destination), one per destination,
+        in the order they have been found.
+        """
+        copies = OrderedDict()
+        output_dir = self.settings['output_dir']
         # static files that aren't associated with pages
         for static_file in self.static_files:
-            dst = join(self.settings['output_dir'],
+            dst = join(output_dir,
                        relpath(static_file, self.settings['project_dir']))
-            self._copy_static_file(static_file, dst)
+            copies.setdefault(dst, static_file)
 
         # static files that are associated with pages
-        page_files = []
         for page in self.pages:
             for static_file in page['static_files']:
-                dst = join(self.settings['output_dir'],
+                dst = join(output_dir,
                            dirname(self._get_output_path(page['url'])),
                            relpath(static_file, dirname(page['path'])))
-                page_files.append((static_file, dst))
-        for static_file, dst in frozenset(page_files):
-            self._copy_static_file(static_file, dst)
+                if copies.setdefault(dst, static_file) != static_file:
+                    logging.warning('"%s" and "%s" are both to be copied'
+                                    ' to "%s", only the former will be.',
+                                    copies[dst], static_file, dst)
+
+        # images of formulas, which are shared by all pages
+        math_dir = join(output_dir,
+                        self.settings.get('math_url', default_math_url)\
+                        .strip('/'))
+        for name, path in sorted(self.math_images.items()):
+            copies.setdefault(join(math_dir, name), path)
+        return [(static_file, dst) for dst, static_file in copies.items()]
+
+    def _copy_static_files(self):
+        """
+        Copies static files to output directory,
+        by setting "io_jobs" threads at once,
+        and schedules their compressed copies.
+        """
+        self.assets = AssetSync(self.settings.get('asset_manifest_path'),
+                                self.settings['output_dir'],
+                                self.settings['hardlinks'])
+        self.assets.load()
+
+        tasks = self._static_file_copies()
+        self.static_outputs = [dst for _, dst in tasks]
+        self.output_files.update(self.static_outputs)
+        io_jobs = self.settings.get('io_jobs') or 1
+        if io_jobs > 1 and len(tasks) > 1:
+            with ThreadPoolExecutor(io_jobs,
+                                    thread_name_prefix='thot-io') as pool:
+                results = list(pool.map(
+                    lambda task: self._copy_static_file(*task), tasks))
+        else:
+            results = [self._copy_static_file(*task) for task in tasks]
+
+        # logged in the order the files have been found
+        failed = 0
+        for (static_file, dst), (is_copied, error) in zip(tasks, results):
+            if error is not None:
+                failed += 1
+                logging.error('Cannot copy "%s" to "%s": %s',
+                              static_file, dst, error)
+                continue
+            logging.debug('copied %s to %s', static_file, dst)
+            if self.compression_formats and any(
+                    static_file.endswith(ending)
+                    for ending in self.settings['compress_if_ending']):
+                # unless the static file comes with such copies of its own
+                self._add_compressed_copies(
+                    dst, not is_copied,
+                    [ext for ext, _ in self.compression_formats
+                     if isfile(static_file + '.' + ext)])
+        for dst in sorted(self.assets.unlinked):
+            logging.debug('Could not create a hardlink for "%s".', dst)
+        if failed:
+            logging.error('%d of %d static files have not been copied.',
+                          failed, len(tasks))
+        self.assets.save()
+
+    def _delete_stale_outputs(self):
+        """
+        Removes outputs of pages and static files
+        which are gone since the last build.
+        """
+        outputs = [page['output_path'] for page in self.pages
+                   if 'output_path' in page] + self.static_outputs
+        stale = self.manifest.set_outputs(outputs)
+        # such as a static file "x.gz" which remains, while "x" is gone
+        current = self.output_files.union(outputs)
+        top = self.settings['output_dir'].rstrip('/') + '/'
+        for output_path in stale:
+            for path in [output_path] + ['%s.%s' % (output_path, ext)
+                                         for ext in COMPRESSION_FORMATS]:
+                if path not in current and exists(path):
+                    logging.debug('removing stale output %s', path)
+                    remove(path)
+            # and directories left empty, below the output directory
+            dirpath = dirname(output_path)
+            while dirpath.startswith(top) \
+                  and isdir(dirpath) and not listdir(dirpath):
+                rmdir(dirpath)
+                dirpath = dirname(dirpath)
+
+    def _delete_unknown_outputs(self):
+        """
+        Removes everything from the output directory
+        which has neither been written nor copied by this build.
+        """
+        for page in self.pages:
+            if page.is_cached and 'output_path' in page:
+                self.output_files.add(page['output_path'])
+                for ext, _ in self.compression_formats:
+                    self.output_files.add('%s.%s' % (page['output_path'],
+                                                     ext))
+        for dirpath, _, filenames in walk(self.settings['output_dir'],
+                                          topdown=False):
+            for filename in filenames:
+                path = join(dirpath, filename)
+                if path not in self.output_files:
+                    logging.debug('removing stale output %s', path)
+                    remove(path)
+            if dirpath != self.settings['output_dir'] and not listdir(dirpath):
+                rmdir(dirpath)
+
+    def _build(self):
+        stage = self.timings.stage
+        has_previous_build = False
+        if self.settings.get('incremental'):
+            with stage('load manifest'):
+                self.manifest = BuildManifest(self.settings['manifest_path'],
+                                              self.settings)
+                has_previous_build = self.manifest.load()
+        with stage('read files'):
+            input_data = self.data_source.read_files()
+        logging.debug('input data %s', input_data)
+        with stage('parse'):
+            self._parse(input_data)
+            self._collect_math_images()
+            trim_caches(self.settings)
+        with stage('sort'):
+            self._sort()
+        # Pages that are streamed get written while rendering.
+        # Else, the output directory remains untouched until all are rendered.
+        if not (self.settings.get('sync')
+                or (self.manifest and has_previous_build)):
+            if self.settings.get('streaming'):
+                with stage('delete output'):
+                    self._delete_output_dir()
+                with stage('render'):
+                    self._render_pages()
+            else:
+                with stage('render'):
+                    self._render_pages()
+                with stage('delete output'):
+                    self._delete_output_dir()
+        else:
+            with stage('render'):
+                self._render_pages()
+        with stage('write'):
+            self._write()
+        with stage('copy static files'):
+            self._copy_static_files()
+        with stage('compress'):
+            self._compress()
+        if self.manifest:
+            with stage('save manifest'):
+                self._delete_stale_outputs()
+                self.manifest.save()
+        if self.settings.get('sync'):
+            with stage('remove unknown outputs'):
+                self._delete_unknown_outputs()
 
     def run(self):
         """Transforms all input and writes to the output directory."""
         start_time = time.time()
-        input_data = self.data_source.read_files()
-        logging.debug('input data %s', input_data)
-        self._parse(input_data)
-        self._sort()
-        self._render_pages()
-        self._delete_output_dir()
-        self._write()
-        self._copy_static_files()
+        if self.settings.get('generations') is None:
+            # a build without generations leaves that mode, if it was in it
+            Generations(self.settings['output_dir'], 0).leave()
+            self._build()
+        else:
+            # build a new generation next to the output directory, in sync
+            # with the one being served, and switch over once it is complete
+            published_dir = self.settings['output_dir']
+            generations = Generations(published_dir,
+                                      self.settings['generations'])
+            with self.timings.stage('stage generation'):
+                staging = generations.stage(self.settings['build_time'])
+            self.settings['output_dir'] = staging
+            self.settings['sync'] = True
+            try:
+                self._build()
+            except BaseException:
+                generations.discard(staging)
+                raise
+            finally:
+                self.settings['output_dir'] = published_dir
+            with self.timings.stage('publish'):
+                generations.publish(staging)
         finish_time = time.time()
         count = len(self.pages)
         print(('OK (%s %s; %s seconds)' % (
             count, 'page' if count == 1 else 'pages',
             round(finish_time - start_time, 2))))
+        if self.timings.enabled:
+            self._report_timings(finish_time - start_time)
+
+    def _report_timings(self, seconds):
+        """Writes the timings to the file given by setting "timings"."""
+        self.timings.save(
+            self.settings['timings'],
+            build_time=self.settings['build_time'].isoformat(),
+            seconds=seconds,
+            page_count=len(self.pages),
+            jobs=self.settings.get('jobs') or 1)
+        print(self.timings.report(self.settings.get('timings_top', 10)))
+        print('Timings have been written to %s' % self.settings['timings'])
 
 
 class FilesystemSource(object):
@@ -341,12 +1039,13 @@ class FilesystemSource(object):
     """
 
     def __init__(self, project_dir, build_time, build_tz,
-                 default_template, page_defaults):
+                 default_template, page_defaults, discovery_jobs=1):
         self.project_dir = project_dir
         self.build_time = build_time
         self.build_tz = build_tz
         self.default_template = default_template
         self.page_defaults = page_defaults
+        self.discovery_jobs = discovery_jobs
 
     def set_urlfunc(self, urlfunc):
         self.get_url = urlfunc
@@ -358,51 +1057,53 @@ class FilesystemSource(object):
         and static files (file extensions for which no parser exists)
         """
         data = OrderedDict()
-        for root, _, files in walk_ignore(self.project_dir):
+        # directory -> those of its ancestors (and itself) with pages,
+        # which static files in directories without pages are assigned to
+        page_dirs = {}
+        matcher = IgnoreMatcher.from_file(join(self.project_dir, IGNORE_FILE))
+        for root, _, files in scan_tree(self.project_dir, matcher,
+                                        self.discovery_jobs):
             pages = []
             parseables = [] # parseable files; rename to (pages)
             static = [] # rename to (static)
 
             # check if a parser exists and append to corresponding list
-            for file in files:
-                path = join(root, file)
-                if parser.get_parser_for_filename(path):
-                    parseables.append(path)
+            for entry in files:
+                if parser.get_parser_for_filename(entry.name):
+                    parseables.append(entry)
                 else:
-                    static.append(path)
+                    static.append(entry.path)
 
             # create pages from parseables
-            for path in parseables:
-                static_files = static if root != self.project_dir else []
-                pages.append(self._create_page(path, static_files))
+            for entry in parseables:
+                static_files = static if root != self.project_dir \
+                               else NO_STATIC_FILES
+                pages.append(self._create_page(entry.path, static_files,
+                                               entry))
 
+            ancestors = page_dirs.get(dirname(root), ()) \
+                        if root != self.project_dir else ()
+            page_dirs[root] = ancestors
             # assign static files with pages
             if pages:
                 data[root] = (pages, static)
-            elif static:
-                # dir has static file(s) but no pages. check if one of
-                # the parent dirs has a page and associate the static files
-                # with it
-                has_parent = False
                 if root != self.project_dir:
-                    parent_dir = dirname(root)
-                    while parent_dir != self.project_dir:
-                        if parent_dir in data:
-                            data.setdefault(parent_dir, ([], []))[1].\
-                                    extend(static)
-                            has_parent = True
-                        parent_dir = dirname(parent_dir)
-                # if no parent dir could be found, or the file is in the
-                # root dir associate the files with the root of the project dir
-                if not has_parent:
+                    page_dirs[root] = (root,) + ancestors
+            elif static:
+                # dir has static file(s) but no pages. associate the
+                # static files with the parent dirs that have pages,
+                # or else with the root of the project dir
+                for parent_dir in ancestors:
+                    data[parent_dir][1].extend(static)
+                if not ancestors:
                     data.setdefault(self.project_dir,
                                     ([], []))[1].extend(static)
         return data
 
-    def _create_page(self, path, static_files):
+    def _create_page(self, path, static_files, entry=None):
         page = Page(db=self, get_url_fn=self.get_url, static_files=static_files)
-        page.update(self.page_defaults.copy())
-        page.update(self._get_default_headers(path))
+        page.use_defaults(self.page_defaults)
+        page.update(self._get_default_headers(path, entry))
         return page
 
     def read(self, path):
@@ -410,9 +1111,24 @@ class FilesystemSource(object):
                          encoding='utf-8') as f:
             return f.read()
 
-    def _get_default_headers(self, path):
+    def read_header(self, path):
+        """
+        Returns the raw header of the page at `path`
+        and the offset of its text, without reading the latter.
+        """
+        with open(join(self.project_dir, path), 'rb') as f:
+            return parser.read_header(f)
+
+    def read_text(self, path, offset):
+        """Returns the text of the page at `path`, which begins at `offset`."""
+        with open(join(self.project_dir, path), 'rb') as f:
+            f.seek(offset)
+            return f.read().decode('utf-8')
+
+    def _get_default_headers(self, path, entry=None):
         """
-        Returns a dict with the default headers for `path`.
+        Returns a dict with the default headers for `path`,
+        whose stat result is taken from `entry` (an os.DirEntry) if given.
 
         `path` - the relative path from the project dir to the file
         `title` - titleized version of the filename
@@ -435,7 +1151,8 @@ class FilesystemSource(object):
             slug = filename
         title = filename.title()
         try:
-            date = pytz.utc.localize(datetime.utcfromtimestamp(getmtime(path)))
+            mtime = entry.stat().st_mtime if entry else getmtime(path)
+            date = pytz.utc.localize(datetime.utcfromtimestamp(mtime))
         except OSError:
             # use the current date if the ctime cannot be accessed
             date = self.build_time
@@ -0,0 +1,147 @@
+"""Discovery of the files a project consists of.
+
+Directories are read by os.scandir(), and their entries are handed out
+as they are, so that whatever the operating system has already told
+about a file need not be asked for again. Names are checked against all
+ignore patterns at once, by a single regular expression.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from fnmatch import translate
+from functools import partial
+from os import scandir
+from os.path import isfile
+import re
+
+__all__ = [
+    'IGNORE_PATTERNS', 'IGNORE_FILE', 'IgnoreMatcher', 'scan_tree',
+]
+
+# files and directories which are never part of a site
+IGNORE_PATTERNS = ('.*', '*~', '#*', '_*')
+# in the project directory, with more patterns one per line
+IGNORE_FILE = '.thotignore'
+
+def _compile(patterns):
+    if not patterns:
+        return None
+    return re.compile('|'.join(translate(p) for p in patterns))
+
+
+class IgnoreMatcher(object):
+    """
+    Tells whether a file or directory is to be ignored.
+
+    Patterns are shell-style, as those of module fnmatch. Those with a "/"
+    are matched against the path relative to the top directory, others
+    against the name alone. Patterns that end in "/" match directories only.
+    """
+
+    def __init__(self, patterns=IGNORE_PATTERNS):
+        self.patterns = tuple(patterns)
+        # (by name, by path) for any entry, and for directories only
+        names, paths, dir_names, dir_paths = [], [], [], []
+        for pattern in self.patterns:
+            dirs_only = pattern.endswith('/')
+            pattern = pattern.rstrip('/')
+            if '/' in pattern:
+                (dir_paths if dirs_only else paths).append(pattern.lstrip('/'))
+            else:
+                (dir_names if dirs_only else names).append(pattern)
+        self._names = _compile(names)
+        self._paths = _compile(paths)
+        self._dir_names = _compile(names + dir_names)
+        self._dir_paths = _compile(paths + dir_paths)
+
+    @classmethod
+    def from_file(cls, path, patterns=IGNORE_PATTERNS):
+        """
+        Returns a matcher of `patterns` and those in the file at `path`,
+        if it exists. Empty lines and those starting with "#" are skipped.
+        """
+        patterns = list(patterns)
+        if isfile(path):
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    line = line.strip()
+                    if not line or line.startswith('#'):
+                        continue
+                    patterns.append(line[1:] if line.startswith('\\#')
+                                    else line)
+        return cls(patterns)
+
+    def ignores(self, name, path, is_dir=False):
+        """True if entry `name`, found at relative `path`, is to be ignored."""
+        by_name, by_path = (self._dir_names, self._dir_paths) if is_dir \
+                           else (self._names, self._paths)
+        return bool((by_name and by_name.match(name))
+                    or (by_path and by_path.match(path)))
+
+
+def scan_dir(path, relative_path, matcher, stat=False):
+    """
+    Returns the entries of directories and those of files in `path`,
+    found at `relative_path` below the top directory, which are not ignored.
+
+    With `stat` the files' stat results are fetched, too,
+    which their entries then keep.
+    """
+    dirs, files = [], []
+    try:
+        entries = scandir(path)
+    except OSError:
+        # as os.walk() does
+        return dirs, files
+    with entries:
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            if matcher.ignores(entry.name, relative_path + entry.name, is_dir):
+                continue
+            if is_dir:
+                dirs.append(entry)
+                continue
+            if stat:
+                try:
+                    entry.stat()
+                except OSError:
+                    pass
+            files.append(entry)
+    return dirs, files
+
+def _scan_tree(top, matcher, scan):
+    # `scan` returns a function, which returns what scan_dir() does
+    stack = [(top, '', scan(top, '', matcher))]
+    while stack:
+        path, relative_path, scanned = stack.pop()
+        dirs, files = scanned()
+        yield path, dirs, files
+        # like os.walk(), don't descend into symlinks to directories
+        subdirs = []
+        for entry in dirs:
+            if not entry.is_symlink():
+                below = relative_path + entry.name + '/'
+                subdirs.append((entry.path, below,
+                                scan(entry.path, below, matcher)))
+        stack.extend(reversed(subdirs))
+
+def scan_tree(top, matcher=None, jobs=1):
+    """
+    Walks the tree at `top` in the order os.walk() would, and yields
+    the path of every directory, and the entries (os.DirEntry) of its
+    directories and of its files which `matcher` does not ignore.
+
+    With `jobs` > 1 directories are read ahead by as many threads,
+    which also fetch the files' stat results.
+    """
+    matcher = matcher or IgnoreMatcher()
+    if jobs <= 1:
+        yield from _scan_tree(top, matcher,
+                              lambda *args: partial(scan_dir, *args))
+        return
+    with ThreadPoolExecutor(jobs, thread_name_prefix='thot-scan') as pool:
+        yield from _scan_tree(
+            top, matcher,
+            lambda *args: pool.submit(scan_dir, *args, stat=True).result)
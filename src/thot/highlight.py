@@ -0,0 +1,119 @@
+"""Syntax highlighting of source code, shared by all parsers.
+
+Highlighted code is memoized in memory and, unless caches are disabled,
+kept in cache "highlighted" across builds. Lexers and formatters are
+made once per process and reused.
+"""
+
+from collections import OrderedDict
+import hashlib
+
+from thot.cache import named_cache
+
+try:
+    import pygments
+    from pygments import highlight
+    from pygments.formatters import HtmlFormatter
+    from pygments.lexers import get_lexer_by_name, TextLexer
+    has_pygments = True
+    pygments_version = pygments.__version__
+except ModuleNotFoundError:
+    has_pygments = False
+    pygments_version = None
+
+__all__ = [
+    'has_pygments', 'pygments_version', 'Highlighter', 'highlighter',
+]
+
+class Highlighter(object):
+    """
+    Highlights code by Pygments, and remembers the outcome
+    in memory (up to `memo_size` entries) and in `cache`, if given.
+    """
+
+    def __init__(self, cache=None, memo_size=4096):
+        self.cache = cache
+        self.memo = OrderedDict()
+        self.memo_size = memo_size
+        self._lexers = {}
+        self._formatters = {}
+
+    def _lexer(self, name):
+        if name not in self._lexers:
+            try:
+                self._lexers[name] = get_lexer_by_name(name)
+            except ValueError:
+                # no lexer found - use the text one instead of an exception
+                self._lexers[name] = TextLexer()
+        return self._lexers[name]
+
+    def _formatter(self, options):
+        key = tuple(sorted(options.items()))
+        if key not in self._formatters:
+            self._formatters[key] = HtmlFormatter(**options)
+        return self._formatters[key]
+
+    @staticmethod
+    def key(*parts):
+        """Digest of `parts`, and of the version of Pygments."""
+        m = hashlib.sha1((pygments_version or '').encode('utf-8'))
+        for part in parts:
+            m.update(b'\0')
+            m.update(part.encode('utf-8') if isinstance(part, str)
+                     else repr(part).encode('utf-8'))
+        return m.hexdigest()
+
+    def memoized(self, key, produce):
+        """
+        Returns the HTML remembered for `key`,
+        else what `produce()` returns, which is then remembered.
+        """
+        html = self.memo.get(key)
+        if html is not None:
+            self.memo.move_to_end(key)
+            return html
+        cached = self.cache.get(key) if self.cache else None
+        if cached is not None:
+            html = cached.decode('utf-8')
+        else:
+            html = produce()
+            if self.cache:
+                self.cache.put(key, html.encode('utf-8'))
+        self.memo[key] = html
+        if len(self.memo) > self.memo_size:
+            self.memo.popitem(last=False)
+        return html
+
+    def highlight(self, code, lexer_name, **formatter_options):
+        """Returns `code` in the language `lexer_name` as HTML."""
+        return self.memoized(
+            self.key('highlight', lexer_name,
+                     sorted(formatter_options.items()), code),
+            lambda: highlight(code, self._lexer(lexer_name),
+                              self._formatter(formatter_options)))
+
+    def hilite(self, code_hilite):
+        """
+        Returns what `code_hilite`, an instance of Markdown's CodeHilite,
+        renders to.
+        """
+        return self.memoized(
+            self.key('codehilite', code_hilite.lang, code_hilite.guess_lang,
+                     code_hilite.use_pygments, code_hilite.lang_prefix,
+                     code_hilite.pygments_formatter,
+                     sorted(code_hilite.options.items()), code_hilite.src),
+            code_hilite.hilite)
+
+
+# per process, by cache
+_highlighters = {}
+
+def highlighter(settings):
+    """
+    The Highlighter for `settings`, which keeps
+    the highlighted code in cache "highlighted", unless disabled.
+    """
+    cache = named_cache(settings, 'highlighted')
+    if id(cache) not in _highlighters:
+        _highlighters[id(cache)] = Highlighter(cache)
+    return _highlighters[id(cache)]
@@ -0,0 +1,211 @@
+"""Rendering of formulas in LaTeX markup to images.
+
+Formulas are rendered in batches, each as a page of its own in one LaTeX
+document, by `latex` and `dvipng` (PNG) or `dvisvgm` (SVG). That happens
+in a temporary directory, without changing the working directory, hence
+can happen in any number of threads or processes at once.
+"""
+
+from os import listdir
+from os.path import join
+from subprocess import run, PIPE
+from tempfile import TemporaryDirectory
+import errno
+import hashlib
+import logging
+import re
+
+from thot.cache import named_cache
+
+__all__ = [
+    'DOC_HEAD', 'supported_image_formats', 'default_image_format',
+    'image_mimetypes',
+    'MathRenderer', 'math_renderer', 'external_math_images',
+]
+
+DOC_HEAD = r'''
+\documentclass[12pt]{article}
+\usepackage[utf8x]{inputenc}
+\usepackage{amsmath}
+\usepackage{amsthm}
+\usepackage{amssymb}
+\usepackage{amsfonts}
+\usepackage{bm}
+\pagestyle{empty}
+'''
+
+supported_image_formats = ('svg', 'png')
+default_image_format = 'png'
+image_mimetypes = {'svg': 'image/svg+xml', 'png': 'image/png'}
+default_math_url = '/_math/'
+
+# commands found missing, which are not tried again
+_missing_commands = set()
+
+def _converter_cmdline(image_format):
+    """Converts all pages of "formulas.dvi" to "formula<page>.<format>"."""
+    return {
+        'png': [
+            'dvipng',
+            '-o', 'formula%d.png',
+            '-T', 'tight',
+            '-bg', 'Transparent',
+            '-z9',
+            'formulas.dvi',
+        ],
+        'svg': [
+            'dvisvgm',
+            '--no-styles', '--no-fonts', # or what IE 10 will display is a mess
+            '--page=1-',
+            '--output=formula%p.svg',
+            'formulas.dvi',
+        ],
+    }[image_format]
+
+def _run(cmdline, cwd, level=logging.ERROR):
+    """
+    Returns True if `cmdline` has been run successfully in `cwd`.
+    A failure is logged with its output at `level`.
+    """
+    try:
+        p = run(cmdline, cwd=cwd, stdout=PIPE, stderr=PIPE, check=False)
+    except OSError as err:
+        if err.errno != errno.ENOENT: # no such file or directory
+            raise
+        _missing_commands.add(cmdline[0])
+        logging.error(
+            '%s command cannot be run, but is needed for math markup.',
+            cmdline[0])
+        return False
+    if p.returncode != 0:
+        logging.log(level,
+                    '%s exited with error: \n[stderr]\n%s\n[stdout]\n%s',
+                    cmdline[0], p.stderr.decode('utf-8', 'replace'),
+                    p.stdout.decode('utf-8', 'replace'))
+        return False
+    return True
+
+
+class MathRenderer(object):
+    """
+    Renders formulas to images, which are kept in `cache`
+    (a thot.cache.FileCache) if one is given.
+    """
+
+    def __init__(self, preamble=DOC_HEAD, cache=None):
+        self.preamble = preamble
+        self.cache = cache
+
+    def key(self, formula, image_format):
+        """Digest of everything that goes into the image of `formula`."""
+        m = hashlib.sha1()
+        for part in (self.preamble, image_format, formula):
+            m.update(part.encode('utf-8'))
+            m.update(b'\0')
+        return m.hexdigest()
+
+    def _render_batch(self, formulas, image_format):
+        """
+        Returns the images of all `formulas` rendered in one document,
+        or None if that has failed.
+
+        Failures of more than one formula are logged at debug level only,
+        as these get rendered one by one afterwards.
+        """
+        converter = _converter_cmdline(image_format)
+        if 'latex' in _missing_commands or converter[0] in _missing_commands:
+            return None
+        level = logging.ERROR if len(formulas) == 1 else logging.DEBUG
+        document = ''.join([
+            self.preamble,
+            '\\begin{document}\n',
+            # an empty page would be skipped, hence the \mbox{}
+            '\n\\clearpage\n'.join('\\mbox{}%s' % f for f in formulas),
+            '\n\\end{document}\n'])
+        with TemporaryDirectory(prefix='thot-latex-') as tmp_dir:
+            with open(join(tmp_dir, 'formulas.tex'), 'w',
+                      encoding='utf-8') as f:
+                f.write(document)
+            if not _run(['latex', '--interaction=nonstopmode',
+                         'formulas.tex'], tmp_dir, level) \
+               or not _run(converter, tmp_dir, level):
+                return None
+            suffix = '.' + image_format
+            pages = sorted(
+                (int(name[len('formula'):-len(suffix)]), name)
+                for name in listdir(tmp_dir)
+                if name.startswith('formula') and name.endswith(suffix)
+                and name[len('formula'):-len(suffix)].isdigit())
+            if len(pages) != len(formulas):
+                return None
+            images = []
+            for _, name in pages:
+                with open(join(tmp_dir, name), 'rb') as f:
+                    images.append(f.read())
+            return images
+
+    def render(self, formulas, image_format=default_image_format):
+        """
+        Returns a dict of every formula in `formulas` to its image as bytes,
+        or to None if it could not be rendered.
+
+        Formulas that have not been rendered before are rendered together.
+        Should that fail, they are rendered one by one,
+        so that a flawed one does not affect the others.
+        """
+        images, missing = {}, []
+        for formula in formulas:
+            if formula in images or formula in missing:
+                continue
+            image = self.cache.get(self.key(formula, image_format)) \
+                    if self.cache else None
+            if image is None:
+                missing.append(formula)
+            else:
+                images[formula] = image
+        if not missing:
+            return images
+
+        rendered = self._render_batch(missing, image_format) \
+                   if len(missing) > 1 else None
+        if rendered is None:
+            rendered = []
+            for formula in missing:
+                image = self._render_batch([formula], image_format)
+                if image is None:
+                    logging.error('Rendering the formula has failed: %s',
+                                  formula)
+                rendered.append(image[0] if image else None)
+        for formula, image in zip(missing, rendered):
+            images[formula] = image
+            if image is not None and self.cache:
+                self.cache.put(self.key(formula, image_format), image)
+        return images
+
+
+def external_math_images(html, settings):
+    """
+    Yields the names of all images of formulas
+    that `html` references instead of embedding them.
+    """
+    if settings.get('math_inline_limit') is None or '/' not in html:
+        return
+    pattern = re.escape(settings.get('math_url', default_math_url)) \
+              + r'([0-9a-f]{40}\.(?:%s))"' % '|'.join(supported_image_formats)
+    yield from re.findall(pattern, html)
+
+
+# per process, by preamble and cache
+_renderers = {}
+
+def math_renderer(settings):
+    """
+    The MathRenderer for `settings`, which uses setting "latex_preamble"
+    and, unless caches are disabled, keeps images in cache "math".
+    """
+    preamble = settings.get('latex_preamble', DOC_HEAD)
+    cache = named_cache(settings, 'math')
+    key = (preamble, id(cache))
+    if key not in _renderers:
+        _renderers[key] = MathRenderer(preamble, cache)
+    return _renderers[key]
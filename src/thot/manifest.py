@@ -0,0 +1,175 @@
+"""Bookkeeping of what a previous build has produced, for incremental builds.
+"""
+
+from os import walk, stat, replace
+from os.path import join, exists, relpath
+import hashlib
+import logging
+import pickle
+
+from thot import version as thot_version
+from thot.parser import parser_id, changed_dependency
+
+__all__ = [
+    'BuildManifest', 'settings_fingerprint',
+]
+
+# settings that change with every invocation and don't affect the output
+VOLATILE_SETTINGS = frozenset([
+    'build_time', 'incremental', 'jobs', 'sync', 'output_dir', 'generations',
+    'streaming', 'timings', 'timings_top', 'use_cache', 'cache_dir',
+    'parse_cache_size', 'discovery_jobs', 'io_jobs', 'compress_jobs',
+    'compress_cache_size',
+])
+
+def _stat_signature(path):
+    """Returns (mtime_ns, size) of `path`, or None if it cannot be accessed."""
+    try:
+        st = stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def settings_fingerprint(settings):
+    """
+    Digest of everything but the pages themselves that goes into rendering:
+    the settings, the templates, and custom url rules.
+    """
+    m = hashlib.sha1(thot_version.encode('utf-8'))
+    for key in sorted(settings):
+        if key not in VOLATILE_SETTINGS:
+            m.update(('%s=%r;' % (key, settings[key])).encode('utf-8'))
+    watched = [settings['url_path']] if 'url_path' in settings else []
+    if 'template_dir' in settings:
+        for template_dir in settings['template_dir'].split(','):
+            for dirpath, _, filenames in walk(template_dir):
+                watched.extend(join(dirpath, f) for f in sorted(filenames))
+    for path in watched:
+        m.update(('%s=%r;' % (path, _stat_signature(path))).encode('utf-8'))
+    return m.hexdigest()
+
+
+class BuildManifest(object):
+    """
+    Records for every page of the last build where it came from, which
+    inputs went into it, and what it looked like after parsing.
+
+    Pages whose inputs did not change since are restored from here
+    instead of being loaded, parsed, rendered and written again.
+    """
+
+    def __init__(self, path, settings):
+        self.path = path
+        self.output_dir = settings['output_dir']
+        self.fingerprint = settings_fingerprint(settings)
+        self.entries = {}     # source path -> entry of the previous build
+        self.outputs = set()  # output paths, relative to output_dir
+        self.new_entries = {}
+        self._static_digests = {}
+
+    def load(self):
+        """
+        Reads the manifest of the previous build.
+
+        Returns False if there was none, or if it has been made
+        with different settings or templates.
+        """
+        if not exists(self.path):
+            return False
+        try:
+            with open(self.path, 'rb') as f:
+                data = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            logging.warning('Ignoring unreadable build manifest "%s": %s',
+                            self.path, e)
+            return False
+        self.outputs = data['outputs']
+        if data['fingerprint'] != self.fingerprint:
+            logging.info('Settings or templates have changed,'
+                         ' all pages will be rebuilt.')
+            return False
+        self.entries = data['entries']
+        return True
+
+    def save(self):
+        data = {
+            'fingerprint': self.fingerprint,
+            'entries': self.new_entries,
+            'outputs': self.outputs,
+        }
+        # replace the old manifest only after the new one is complete
+        with open(self.path + '.tmp', 'wb') as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        replace(self.path + '.tmp', self.path)
+
+    def _static_digest(self, static_files):
+        """
+        Digest of the files accompanying a page, as these are read
+        by processors such as 'comments_from_files'.
+        Such lists are shared by all pages of a directory.
+        """
+        key = id(static_files)
+        if key not in self._static_digests:
+            m = hashlib.sha1()
+            for path in sorted(static_files):
+                m.update(('%s=%r;' % (path, _stat_signature(path)))\
+                         .encode('utf-8'))
+            self._static_digests[key] = (m.hexdigest(), static_files)
+        return self._static_digests[key][0]
+
+    def _source_signature(self, page):
+        return _stat_signature(join(page.db.project_dir, page['path']))
+
+    def restore(self, page):
+        """
+        Returns the parsed state of `page` as of the last build
+        if none of its inputs has changed, else None.
+        """
+        entry = self.entries.get(page['path'])
+        if entry is None or not hasattr(page.db, 'project_dir'):
+            return None
+        if entry['parser'] != parser_id(page.get_parser_class()) \
+           or entry['static'] != self._static_digest(page['static_files']):
+            return None
+        # the page's default date is its file's mtime,
+        # so a touched file counts as changed even if its content is not
+        if self._source_signature(page) != entry['stat']:
+            return None
+        # such as those included by reStructuredText
+        if 'content' not in entry \
+           or changed_dependency(entry['dependencies']) is not None:
+            return None
+        self.new_entries[page['path']] = entry
+        state = pickle.loads(entry['page'])
+        state['content'] = entry['content']
+        return state
+
+    def record(self, page, headers, dependencies=()):
+        """
+        Remembers `page` as it is right after having been parsed: its
+        content, and its `headers` (pickled) as they have been before
+        any processor has seen the page, which get to see it again once
+        it is restored. Also remembers the files it has read while being
+        parsed, as parser.sign_dependencies() returns them.
+        """
+        if not hasattr(page.db, 'project_dir'):
+            return
+        self.new_entries[page['path']] = {
+            'stat': self._source_signature(page),
+            'parser': parser_id(page.get_parser_class()),
+            'template': page['template'],
+            'static': self._static_digest(page['static_files']),
+            'dependencies': list(dependencies),
+            'page': headers,
+            'content': page['content'],
+        }
+
+    def set_outputs(self, output_paths):
+        """
+        Replaces the list of known outputs with `output_paths`
+        and returns those that no longer belong to any page.
+        """
+        current = set(relpath(p, self.output_dir) for p in output_paths)
+        stale = self.outputs - current
+        self.outputs = current
+        return sorted(join(self.output_dir, p) for p in stale)
@@ -2,17 +2,43 @@
 """
 
 from datetime import datetime, date, time
+from os import stat
 from os.path import splitext
+import hashlib
+import json
 import logging
 
+from dateutil.parser import isoparse
 import pkg_resources
 import pytz
 import yaml
 
+try:
+    import tomllib
+except ModuleNotFoundError:
+    try:
+        import tomli as tomllib
+    except ModuleNotFoundError:
+        tomllib = None
+
+from thot import version as thot_version
+
 __all__ = [
-    'ParserException', 'Parser', 'get_parser_for_filename',
+    'ParserException', 'Parser', 'get_parser_for_filename', 'read_header',
+    'parser_id', 'yaml_load', 'load_header', 'pack_parsed', 'unpack_parsed',
+    'sign_dependencies', 'changed_dependency',
 ]
 
+# LibYAML's loader is much faster, if PyYAML has been built with it
+SafeLoader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# first line of the header -> its last line, and whether that is part of it
+FRONT_MATTER = {
+    '---': ('---', False),  # YAML
+    '+++': ('+++', False),  # TOML
+    '{': ('}', True),       # JSON
+}
+
 class ParserException(Exception):
     """Exception raised for errors during the parsing."""
     pass
@@ -21,23 +47,88 @@ class ParserException(Exception):
 parser_map = dict()
 
 
+def yaml_load(stream):
+    """Like yaml.safe_load(), but by LibYAML if available."""
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def load_header(header_raw):
+    """
+    Returns the headers in `header_raw`, which are written in YAML,
+    in TOML if enclosed by lines "+++", or in JSON if enclosed by lines
+    "{" and "}". Anything else starting with "{" is a mapping in YAML.
+
+    Raises ParserException if headers in JSON or TOML can't be decoded.
+    """
+    opening = _opening_line(header_raw)
+    if opening == '{':
+        try:
+            return json.loads(header_raw)
+        except ValueError as e:
+            try:
+                # YAML's flow style, spread over lines
+                return yaml_load(header_raw)
+            except yaml.YAMLError:
+                raise ParserException('Invalid headers in JSON: %s' % e)
+    if opening == '+++':
+        if tomllib is None:
+            raise ParserException(
+                'Headers in TOML need Python 3.11, or package "tomli".')
+        try:
+            return tomllib.loads(header_raw.split('\n', 1)[1] \
+                                 if '\n' in header_raw else '')
+        except tomllib.TOMLDecodeError as e:
+            raise ParserException('Invalid headers in TOML: %s' % e)
+    return yaml_load(header_raw)
+
+
+def _opening_line(source):
+    """
+    Returns the line which opens the front matter `source` starts with,
+    or None if there is none.
+    """
+    first = source.split('\n', 1)[0]
+    if first.startswith('---'):
+        return '---'
+    if first.startswith('+++'):
+        return '+++'
+    if first == '{':
+        return '{'
+    return None
+
+
 class Parser(object):
     """Mixin for anything that consumes input text.
 
     Overwrite at least _parse_text()
     and member variables output_ext, parses.
+
+    Parsers whose output depends on nothing but the text, their version,
+    the settings named in `cache_settings` and the files they list
+    in `dependencies` while parsing set `cacheable`.
     """
     output_ext = None
     parses = ['html', 'htm', 'xml', 'txt',
         'sitemap.json', 'tags.json', 'categories.json']
+    cacheable = False
+    cache_settings = ()
 
-    def __init__(self, settings, source, filename):
+    def __init__(self, settings, source, filename, header_raw=None):
+        """
+        `source` can be None if `header_raw` is given instead,
+        in which case `text` is to be set before calling parse().
+        """
         self.settings = settings
         self.source = source
         self.headers = {}
-        self.header_raw = ''
+        self.header_raw = header_raw or ''
         self.text = ''
         self.filename = filename
+        # paths of the files read while parsing, besides the source
+        self.dependencies = []
+        # set while parsing if the outcome is not to be kept for later builds,
+        # as it lacks something that might work next time
+        self.is_transient = False
 
     def parse_headers(self):
         """
@@ -45,7 +136,7 @@ class Parser(object):
         """
         if not self.headers:
             self._split_input()
-            self.headers = yaml.safe_load(self.header_raw) \
+            self.headers = load_header(self.header_raw) \
                 if self.header_raw != '' else {}
             if 'mtime' in self.headers:
                 # pylint: disable=logging-not-lazy
@@ -67,6 +158,12 @@ class Parser(object):
         """
         Applies the user's timezone.
         """
+        if isinstance(value, str):
+            # JSON has no type for dates
+            try:
+                value = isoparse(value)
+            except ValueError:
+                pass
         assert not isinstance(value, str), \
             'Date header has been set in "%s" but cannot be parsed.'\
             + ' Please use ISO-8601. Time with seconds.' \
@@ -111,11 +208,16 @@ class Parser(object):
         Segregates header from actual text.
         Used to later parse these parts a different way.
         """
-        if self.text:
+        if self.text or self.source is None:
             return
         parts = []
-        if self.source.startswith('---') and self.source.count('---\n') >= 2:
-            parts = self.source.split('\n---\n', 1)
+        opening = _opening_line(self.source)
+        if opening:
+            closing, inclusive = FRONT_MATTER[opening]
+            if self.source.count(closing + '\n') >= 2 - inclusive:
+                parts = self.source.split('\n%s\n' % closing, 1)
+                if inclusive and len(parts) == 2:
+                    parts[0] += '\n' + closing
         if len(parts) < 2:
             parts = self.source.split('\n\n', 1)
         if len(parts) >= 2:
@@ -134,6 +236,107 @@ class Parser(object):
         self._parse_text()
         return (self.headers, self.text)
 
+    def cache_key(self):
+        """
+        Digest of everything the parsed text depends on,
+        or None if it is not to be cached.
+        """
+        if not self.cacheable:
+            return None
+        self._split_input()
+        m = hashlib.sha1(parser_id(type(self)).encode('utf-8'))
+        # entries are as pack_parsed() makes them
+        m.update(b'dependencies;')
+        for key in self.cache_settings:
+            m.update(('%s=%r;' % (key, self.settings.get(key)))\
+                     .encode('utf-8'))
+        m.update(self.text.encode('utf-8'))
+        return m.hexdigest()
+
+
+def parser_id(parser_cls):
+    """Identifies a parser and its version."""
+    return '%s.%s:%s' % (parser_cls.__module__, parser_cls.__qualname__,
+                         getattr(parser_cls, 'version', thot_version))
+
+
+def _file_signature(path):
+    """Returns [mtime_ns, size] of `path`, or None if it cannot be accessed."""
+    try:
+        st = stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+def sign_dependencies(paths):
+    """Returns [path, signature] of every file in `paths`, as it is now."""
+    return [[path, _file_signature(path)] for path in paths]
+
+def changed_dependency(signed):
+    """
+    Returns the first path in `signed`, as made by sign_dependencies(),
+    whose file has changed since, or None.
+    """
+    for path, signature in signed:
+        if _file_signature(path) != signature:
+            return path
+    return None
+
+def pack_parsed(content, dependencies):
+    """
+    Returns parsed `content` as bytes to be cached, along with
+    the signatures of the files in `dependencies` as they are now.
+    """
+    signed = sign_dependencies(dependencies)
+    return (json.dumps(signed) + '\n' + content).encode('utf-8')
+
+def unpack_parsed(value):
+    """
+    Returns the content packed into `value` by pack_parsed() and the paths
+    of the files it depends on, or None if any of these has changed since.
+    """
+    signed, content = value.decode('utf-8').split('\n', 1)
+    signed = json.loads(signed)
+    changed = changed_dependency(signed)
+    if changed is not None:
+        logging.debug('%s has changed, parsing again', changed)
+        return None
+    return content, [path for path, _ in signed]
+
+
+def read_header(f):
+    """
+    Reads binary file `f` only as far as the header of a page goes.
+
+    Returns the header as string, or None if there is none,
+    and the offset at which the text begins.
+    Headers are recognized the same way Parser._split_input() does.
+    """
+    first = f.readline()
+    opening = _opening_line(first.decode('utf-8', 'replace'))
+    if opening:
+        # enclosed by lines "---", "+++", or "{" and "}"
+        closing, inclusive = FRONT_MATTER[opening]
+        closing = closing.encode('utf-8') + b'\n'
+        lines, offset = [first], len(first)
+        for line in iter(f.readline, b''):
+            offset += len(line)
+            if line == closing:
+                if inclusive:
+                    lines.append(line)
+                return b''.join(lines)[:-1].decode('utf-8'), offset
+            lines.append(line)
+        f.seek(len(first))
+
+    # ends with the first empty line
+    lines, offset = [first], len(first)
+    for line in iter(f.readline, b''):
+        offset += len(line)
+        if line == b'\n':
+            return b''.join(lines)[:-1].decode('utf-8'), offset
+        lines.append(line)
+    return None, 0
+
 
 def get_parser_for_filename(filename):
     """
@@ -10,6 +10,8 @@ import logging
 
 import yaml
 
+from thot.parser import yaml_load
+
 __all__ = [
     'CommentsFromFile',
 ]
@@ -60,7 +62,7 @@ class CommentsFromFile(object):
     def parse(self, comment_file):
         try:
             with codecs.open(comment_file, 'r', encoding='utf-8') as f:
-                comments = yaml.safe_load(f)
+                comments = yaml_load(f)
                 return comments or []
         except yaml.YAMLError as e:
             logging.error(e)
@@ -13,6 +13,7 @@ __all__ = [
 class CreoleParser(Parser):
     output_ext = 'html'
     parses = ['creole', 'cre']
+    cacheable = True
 
     def _parse_text(self):
         self.text = creole2html(self.text)
@@ -1,14 +1,21 @@
 """Plugin that enriches HTML output generated by templates.
 
+Every page is parsed once, and handed as tree to all transforms that are
+registered in entry point group "thot.html_transforms", before it is
+serialized again. Transforms that only read the page can do with the
+events of a parser instead, for which no tree needs to be built.
+
 Currently this contains no more than hyphenation
 (of text between tags).
 """
 # pylint: disable=invalid-name
 
+from functools import lru_cache
 import logging
 import re
 
 from lxml import etree
+import pkg_resources
 
 from thot.utils import partition
 
@@ -28,7 +35,7 @@ except ModuleNotFoundError:
     logging.debug('Wordaxe is not available for hyphenation.')
 
 __all__ = [
-    'HtmlPostProcessor',
+    'HtmlTransform', 'HtmlHyphenator', 'HtmlPostProcessor',
 ]
 
 def wordaxe_hyphenation_wrapper(hyphenator, word):
@@ -37,8 +44,91 @@ def wordaxe_hyphenation_wrapper(hyphenator, word):
     marked_word = HtmlHyphenator.html_hypenation_mark.join(partitions)
     return marked_word
 
-class HtmlHyphenator(object):
-    """Hyphenator of text nodes."""
+class HtmlTransform(object):
+    """
+    Transform of rendered pages, to be registered
+    in entry point group "thot.html_transforms".
+
+    Transforms that change pages override transform(), which gets
+    the tree of the page, shared by all transforms. Those that only read
+    pages set `streaming` and override target() instead.
+    """
+
+    # True if target() suffices, and transform() is not needed
+    streaming = False
+
+    @classmethod
+    def prepare(cls, pages):
+        """Called once all `pages` have been parsed, before any is rendered."""
+        pass
+
+    @classmethod
+    def transform(cls, page, dom_tree):
+        """Changes `dom_tree`, the root element of `page`, in place."""
+        pass
+
+    @classmethod
+    def target(cls, page):
+        """
+        Returns a parser target for `page`, or None. That is an object with
+        any of the methods start(tag, attrib), end(tag), data(text),
+        comment(text), pi(target, data) and close(), which get called
+        in document order.
+        """
+        return None
+
+
+class _Targets(object):
+    """Parser target that passes all events on to `targets`."""
+
+    def __init__(self, targets):
+        self.targets = targets
+        for name in ('start', 'end', 'data', 'comment', 'pi'):
+            methods = [getattr(t, name) for t in targets if hasattr(t, name)]
+            setattr(self, name, self._broadcast(methods))
+
+    @staticmethod
+    def _broadcast(methods):
+        def call(*args):
+            for method in methods:
+                method(*args)
+        return call
+
+    def close(self):
+        for target in self.targets:
+            if hasattr(target, 'close'):
+                target.close()
+
+def feed_tree(root, target):
+    """
+    Calls the methods of parser target `target` for every element
+    of the tree at `root`, as a parser of it would.
+    """
+    events = ('start', 'end', 'comment', 'pi')
+    for event, elem in etree.iterwalk(root, events=events):
+        if event == 'start':
+            target.start(elem.tag, dict(elem.attrib))
+            if elem.text:
+                target.data(elem.text)
+            continue
+        if event == 'end':
+            target.end(elem.tag)
+        elif event == 'comment':
+            target.comment(elem.text)
+        else:
+            target.pi(elem.target, elem.text)
+        if elem.tail and elem is not root:
+            target.data(elem.tail)
+    target.close()
+
+
+class HtmlHyphenator(HtmlTransform):
+    """
+    Hyphenator of text nodes.
+
+    Hyphenators, and the words they have hyphenated, are kept per language
+    for the lifetime of the process, and are shared by all pages.
+    """
 
     # maps language-code to hyphenation facility
     hyphenator = dict()
@@ -47,6 +137,8 @@ class HtmlHyphenator(object):
     # See http://www.w3.org/TR/html401/struct/text.html#h-9.3.3
     html_hypenation_mark = '\xad'
     dont_hyphenate_if_in = set(['head', 'pre', 'code', 'script', 'style'])
+    # hyphenated words remembered per language
+    memo_size = 1 << 16
 
     # subsequent functions are able to handle nubers and symbols
     word_detection_pattern = re.compile(r'\w{5,}', re.UNICODE)
@@ -59,20 +151,61 @@ class HtmlHyphenator(object):
             if 'lang' in ancestor.attrib:
                 return ancestor.attrib['lang']
 
+    @classmethod
+    def prepare(cls, pages):
+        """
+        Loads the hyphenators of all languages of pages in advance,
+        so that processes which render pages share them.
+        """
+        for lang in sorted(set(page['language'] for page in pages
+                               if page.get('language'))):
+            cls._get_hyphenator(lang)
+
     @classmethod
     def transform(cls, _, dom_tree):
-        language_annotated_text = \
-            'body//*[ancestor-or-self::*/@lang and string-length(text()) > 5]'
-        for elem in dom_tree.xpath(language_annotated_text):
-            tag_path = [ancestor.tag for ancestor in elem.iterancestors()]
-            if not HtmlHyphenator.dont_hyphenate_if_in.intersection(tag_path):
-                lang = HtmlHyphenator.get_language(elem)
-
-                if elem.text and not elem.text.isspace():
-                    elem.text = cls._hyphenate(elem.text, lang)
-                for child in elem.iterchildren():
-                    if child.tail and not child.tail.isspace():
-                        child.tail = cls._hyphenate(child.tail, lang)
+        """
+        Hyphenates the text of elements in the body that are in a language,
+        and the tails of their children, except within elements
+        in `dont_hyphenate_if_in`. Elements whose first text is
+        five characters or shorter are left alone.
+
+        The tree is walked once, keeping the language of every level
+        on a stack. Elements to be skipped are not entered at all.
+        """
+        body = dom_tree.find('body')
+        if body is None:
+            return
+        # (iterator over the children of an element, its language)
+        stack = [(iter(body), cls.get_language(body))]
+        while stack:
+            children, lang = stack[-1]
+            elem = next(children, None)
+            if elem is None:
+                stack.pop()
+                continue
+            # not comments or processing instructions
+            if not isinstance(elem.tag, str) \
+               or elem.tag in cls.dont_hyphenate_if_in:
+                continue
+            elem_lang = elem.get('lang', lang)
+            if elem_lang and len(cls._first_text(elem)) > 5:
+                if elem.text:
+                    elem.text = cls._hyphenate(elem.text, elem_lang)
+                for child in elem:
+                    if child.tail:
+                        child.tail = cls._hyphenate(child.tail, elem_lang)
+            if len(elem):
+                stack.append((iter(elem), elem_lang))
+
+    @staticmethod
+    def _first_text(elem):
+        """Returns the first text node directly within `elem`, or ''."""
+        if elem.text:
+            return elem.text
+        for child in elem:
+            if child.tail:
+                return child.tail
+        return ''
 
     @classmethod
     def _get_hyphenator(cls, lang):
@@ -80,45 +213,111 @@ class HtmlHyphenator(object):
             if has_wordaxe and lang in wordaxe_languages:
                 h = DCWHyphenator(lang, minWordLength=3)
                 HtmlHyphenator.hyphenator[lang] = h
-                HtmlHyphenator.hyphenator_f[lang] = \
-                    lambda w: wordaxe_hyphenation_wrapper(h, w)
+                f = lambda w: wordaxe_hyphenation_wrapper(h, w)
             elif has_pyphen and lang in pyphen.LANGUAGES:
                 h = pyphen.Pyphen(lang=lang)
                 HtmlHyphenator.hyphenator[lang] = h
-                HtmlHyphenator.hyphenator_f[lang] = \
-                    lambda w: h.inserted(w,
-                        hyphen=HtmlHyphenator.html_hypenation_mark)
+                f = lambda w: h.inserted(w,
+                    hyphen=HtmlHyphenator.html_hypenation_mark)
             else:
-                HtmlHyphenator.hyphenator_f[lang] = lambda x: x
+                f = None
+            HtmlHyphenator.hyphenator_f[lang] = \
+                lru_cache(maxsize=cls.memo_size)(f) if f else None
         return HtmlHyphenator.hyphenator_f[lang]
 
     @classmethod
     def _hyphenate(cls, text, language):
         hyphenator = cls._get_hyphenator(language)
+        if hyphenator is None:
+            return text
         return HtmlHyphenator.word_detection_pattern.sub(
             lambda matchobj: hyphenator(matchobj.group(0)),
             text,
         )
 
 
+# shipped with thot, hence available even if its entry points are not
+BUILTIN_TRANSFORMS = {
+    'hyphenate': HtmlHyphenator,
+}
+
+def load_transforms(names=None):
+    """
+    Returns the transforms registered in entry point group
+    "thot.html_transforms", or built in, all of them by name
+    or those in `names`.
+    """
+    available = dict(BUILTIN_TRANSFORMS)
+    entrypoints = list(pkg_resources.iter_entry_points('thot.html_transforms'))
+    if not entrypoints:
+        # as in a checkout whose entry points predate the group
+        logging.debug('No HTML transforms are registered in entry point'
+                      ' group "thot.html_transforms", only the built-in'
+                      ' ones are available.')
+    for entrypoint in entrypoints:
+        try:
+            available[entrypoint.name] = entrypoint.load()
+        except Exception as e: # pylint: disable=broad-except
+            logging.warning('HTML transform "%s" has not been loaded'
+                            ' due to: %s', entrypoint, e)
+    if names is None:
+        return [available[name] for name in sorted(available)]
+    transforms = []
+    for name in names:
+        if name in available:
+            transforms.append(available[name])
+        else:
+            logging.error('HTML transform "%s" is not available.', name)
+    return transforms
+
+
 class HtmlPostProcessor(object):
-    """Collector of HTML postprocessing functions."""
+    """
+    Pipeline of HTML transforms, run on every rendered page.
+
+    Setting "html_transforms" lists the transforms to run, in order;
+    by default all of them run, ordered by name.
+    """
 
-    run_at = ['after_rendering', ]
+    run_at = ['after_parsing', 'after_rendering', ]
 
     def __init__(self, site, settings):
         self.site = site
         self.site_settings = settings
+        self.transforms = load_transforms(settings.get('html_transforms'))
+        self.tree_transforms = [t for t in self.transforms if not t.streaming]
         logging.debug('Plugin "%s" has been initalized.', self)
 
+    def after_parsing(self, pages):
+        for transform in self.transforms:
+            transform.prepare(pages)
+
     def after_rendering(self, page):
         """Entry point.
-        Gets the rendered page as unicode string and breaks it down to DOM.
+        Gets the rendered page as unicode string and breaks it down to DOM,
+        once for all transforms, unless these only need parser events.
         """
-        parser = etree.HTMLParser(encoding='utf-8')
-        dom_tree = etree.fromstring(page['rendered'].encode('utf-8'), parser)
+        targets = [t.target(page) for t in self.transforms if t.streaming]
+        targets = [t for t in targets if t is not None]
+        if not self.tree_transforms and not targets:
+            return
+        rendered = page['rendered']
+        if isinstance(rendered, str):
+            rendered = rendered.encode('utf-8')
 
-        HtmlHyphenator.transform(page, dom_tree)
+        if not self.tree_transforms:
+            # the page stays as it is, hence no tree is needed
+            parser = etree.HTMLParser(encoding='utf-8',
+                                      target=_Targets(targets))
+            etree.fromstring(rendered, parser)
+            return
+
+        parser = etree.HTMLParser(encoding='utf-8')
+        dom_tree = etree.fromstring(rendered, parser)
+        for transform in self.tree_transforms:
+            transform.transform(page, dom_tree)
+        if targets:
+            feed_tree(dom_tree, _Targets(targets))
 
         page['rendered'] = etree.tostring(
             dom_tree, xml_declaration=False, encoding='utf-8')
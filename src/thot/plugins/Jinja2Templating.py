@@ -21,9 +21,13 @@ class Jinja2Template(object):
 
     def __init__(self, settings):
         self.settings = settings
-        self.env = Environment(loader=ChoiceLoader([
-            FileSystemLoader(self.settings['template_dir']),
-            PackageLoader('thot')]))
+        loaders = [FileSystemLoader(self.settings['template_dir'])]
+        try:
+            loaders.append(PackageLoader('thot'))
+        except ValueError:
+            # newer Jinja2 refuses packages without a 'templates' directory
+            pass
+        self.env = Environment(loader=ChoiceLoader(loaders))
         self.env.filters['datetimeformat'] = datetimeformat
         self.env.filters['ordinalsuffix'] = ordinal_suffix
 
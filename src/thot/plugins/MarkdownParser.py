@@ -3,21 +3,114 @@
 # pylint: disable=invalid-name
 
 import markdown
+from markdown.extensions.codehilite import CodeHilite, CodeHiliteExtension, \
+    HiliteTreeprocessor
 
+from thot import version as thot_version
+from thot.highlight import highlighter, pygments_version
 from thot.parser import Parser
 
 __all__ = [
-    'MarkdownParser',
+    'MarkdownParser', 'converter',
 ]
 
+DEFAULT_EXTENSIONS = ['codehilite']
+DEFAULT_EXTENSION_CONFIGS = {'codehilite': {'css_class': 'highlight'}}
+
+class SharedHiliteTreeprocessor(HiliteTreeprocessor):
+    """
+    Highlights code blocks like extension "codehilite" does,
+    by the highlighting service shared with other parsers.
+    """
+
+    highlighter = None
+
+    def run(self, root):
+        for block in root.iter('pre'):
+            if len(block) == 1 and block[0].tag == 'code':
+                local_config = self.config.copy()
+                text = block[0].text
+                if text is None:
+                    continue
+                code = CodeHilite(
+                    self.code_unescape(text),
+                    tab_length=self.md.tab_length,
+                    style=local_config.pop('pygments_style', 'default'),
+                    **local_config
+                )
+                placeholder = self.md.htmlStash.store(
+                    self.highlighter.hilite(code))
+                block.clear()
+                block.tag = 'p'
+                block.text = placeholder
+
+
+class SharedCodeHiliteExtension(CodeHiliteExtension):
+    """Extension "codehilite", by the shared highlighting service."""
+
+    def __init__(self, highlighter_, **kwargs):
+        self.highlighter = highlighter_
+        super().__init__(**kwargs)
+
+    def extendMarkdown(self, md):
+        hiliter = SharedHiliteTreeprocessor(md)
+        hiliter.config = self.getConfigs()
+        hiliter.highlighter = self.highlighter
+        md.treeprocessors.register(hiliter, 'hilite', 30)
+        md.registerExtension(self)
+
+
+# per process, by extensions and their configuration
+_converters = {}
+
+def converter(settings):
+    """
+    The Markdown instance for `settings`, which is made once per process.
+
+    Extensions are those of setting "markdown_extensions", configured by
+    "markdown_extension_configs" (a dict by extension). Extension
+    "codehilite" is replaced by one that uses the shared highlighter.
+    """
+    extensions = settings.get('markdown_extensions', DEFAULT_EXTENSIONS)
+    configs = settings.get('markdown_extension_configs',
+                           DEFAULT_EXTENSION_CONFIGS)
+    shared_highlighter = highlighter(settings)
+    key = (repr(extensions), repr(configs), id(shared_highlighter))
+    if key not in _converters:
+        _converters[key] = markdown.Markdown(
+            extensions=[
+                SharedCodeHiliteExtension(shared_highlighter,
+                                          **configs.get(name, {}))
+                if name in ('codehilite', 'markdown.extensions.codehilite')
+                else name
+                for name in extensions],
+            extension_configs={
+                name: config for name, config in configs.items()
+                if name not in ('codehilite', 'markdown.extensions.codehilite')
+            })
+    return _converters[key]
+
+
 class MarkdownParser(Parser):
     """Markdown Parser"""
     output_ext = 'html'
     parses = ['md', 'markdown']
+    version = '%s+markdown-%s+pygments-%s' % (
+        thot_version, markdown.__version__, pygments_version)
+    cacheable = True
+    cache_settings = ('markdown_extensions', 'markdown_extension_configs')
 
-    def _parse_text(self):
-        self.text = markdown.markdown(
-            self.text,
-            extensions=['codehilite(css_class=highlight)'],
-        )
+    @staticmethod
+    def convert_all(settings, texts):
+        """
+        Converts every Markdown text in `texts` to HTML,
+        which are returned in the same order.
+        """
+        md = converter(settings)
+        html = []
+        for text in texts:
+            html.append(md.reset().convert(text))
+        return html
 
+    def _parse_text(self):
+        self.text = converter(self.settings).reset().convert(self.text)
@@ -2,31 +2,31 @@
 """
 # pylint: disable=invalid-name
 
-import os
+from os.path import abspath
 import logging
 
-from docutils import nodes, utils
-from docutils.core import publish_parts
+import docutils
+from docutils import io, nodes, utils
+from docutils.core import Publisher
+from docutils.parsers import rst
 from docutils.parsers.rst import directives, roles, Directive
-from docutils.writers import html4css1
+from docutils.readers import standalone
+from docutils.transforms import frontmatter, universal
+from docutils.writers import html4css1, html5_polyglot
 
+from thot import version as thot_version
+from thot.highlight import Highlighter, highlighter, has_pygments, \
+    pygments_version
 from thot.parser import Parser
-from thot.utils import supported_image_formats, default_image_format, \
-    render_latex_to_image, embed_image
+from thot.latex import MathRenderer, math_renderer, \
+    supported_image_formats, default_image_format, image_mimetypes, \
+    default_math_url
+from thot.utils import data_uri
 
 __all__ = [
     'RstParser',
 ]
 
-try:
-    from pygments import highlight
-    from pygments.formatters import HtmlFormatter
-    from pygments.lexers import get_lexer_by_name, TextLexer
-    has_pygments = True
-except ModuleNotFoundError:
-    has_pygments = False
-
-
 # from sphinx.util.nodes
 
 def set_source_info(directive, node):
@@ -130,34 +130,71 @@ class PygmentsDirective(Directive):
         """
         Parse sourcecode using Pygments.
         """
-        try:
-            lexer = get_lexer_by_name(self.arguments[0])
-        except ValueError:
-            # no lexer found - use the text one instead of an exception
-            lexer = TextLexer()
-        # take an arbitrary option if more than one is given
-        formatter = HtmlFormatter(noclasses=False)
-        parsed = highlight('\n'.join(self.content), lexer, formatter)
+        highlighter_ = getattr(self.state.document.settings, 'highlighter',
+                               None) or Highlighter()
+        parsed = highlighter_.highlight('\n'.join(self.content),
+                                        self.arguments[0], noclasses=False)
         return [nodes.raw('', parsed, format='html')]
 
 
 # original work
 
-class ThotHTMLWriter(html4css1.Writer):
+class ThotReader(standalone.Reader):
     """
-    Writer to attach the 'translator' for additional directives.
+    Reader which leaves out transforms that do nothing with our settings.
     """
 
-    def __init__(self):
-        html4css1.Writer.__init__(self)
-        self.translator_class = ThotHTMLTranslator
+    # no document title or subtitles, no header or footer,
+    # neither "smart quotes" nor internals exposed
+    skipped_transforms = (
+        frontmatter.DocTitle,
+        frontmatter.SectionSubTitle,
+        universal.Decorations,
+        universal.ExposeInternals,
+        universal.SmartQuotes,
+    )
+
+    def get_transforms(self):
+        return [t for t in standalone.Reader.get_transforms(self)
+                if t not in self.skipped_transforms]
 
 
-class ThotHTMLTranslator(html4css1.HTMLTranslator):
+class ThotTranslatorMixin(object):
     """
     Visitor of custom directives created above.
+
+    All formulas of a document are rendered at once, in advance.
+    Images larger than setting "math_inline_limit" (in bytes) are referenced
+    by "<math_url><digest>.<format>" instead of being embedded, provided
+    they are kept in a cache, whence Site copies them to the output.
     """
 
+    def _prepare_math(self, document):
+        self.math_renderer = getattr(document.settings, 'math_renderer',
+                                     None) or MathRenderer()
+        self.math_inline_limit = getattr(document.settings,
+                                         'math_inline_limit', None)
+        self.math_url = getattr(document.settings, 'math_url',
+                                default_math_url)
+        formulas = {}   # image format -> list of formulas
+        find = getattr(document, 'findall', document.traverse)
+        for node in find(lambda n: isinstance(n, (math, displaymath))):
+            formulas.setdefault(node['image_format'], [])\
+                .append(self._math_latex(node))
+        self.math_images = {}
+        for image_format, latex in formulas.items():
+            for formula, image in self.math_renderer.render(
+                    latex, image_format).items():
+                self.math_images[(formula, image_format)] = image
+
+    def _math_latex(self, node):
+        """The LaTeX markup to render for a math or displaymath node."""
+        if isinstance(node, math):
+            return '$' + node['latex'] + '$'
+        if node['nowrap']:
+            return node['latex']
+        return self._wrap_displaymath(node['latex'])
+
     def _wrap_displaymath(self, latex_text, label=None):
         parts = latex_text.split('\n\n')
         ret = []
@@ -170,34 +207,37 @@ class ThotHTMLTranslator(html4css1.HTMLTranslator):
         return '\\begin{gather}\n' + '\\\\'.join(ret) + '\n\\end{gather}'
 
     def _render_math(self, latex, alt_text=None, image_format=None):
-        png_path = render_latex_to_image(latex, image_format)
-        if png_path:
-            embedded_image = embed_image(png_path)
-            os.remove(png_path)
-
-            # build the actual element
-            alt_text = self.encode(alt_text).strip() if alt_text \
-                       else self.encode(latex).strip()
-            return '<img class="math" src="%s" alt="%s" />' % \
-                   (embedded_image, alt_text)
-        else:
-            logging.error('Rendering the formula has failed: %s', latex)
+        image_format = image_format or default_image_format
+        if (latex, image_format) not in self.math_images:
+            self.math_images.update(
+                ((formula, image_format), image) for formula, image
+                in self.math_renderer.render([latex], image_format).items())
+        image = self.math_images[(latex, image_format)]
+        if image is None:
             return None
 
+        # build the actual element
+        alt_text = self.encode(alt_text).strip() if alt_text \
+                   else self.encode(latex).strip()
+        if self.math_inline_limit is not None and self.math_renderer.cache \
+           and len(image) > self.math_inline_limit:
+            src = '%s%s.%s' % (self.math_url,
+                               self.math_renderer.key(latex, image_format),
+                               image_format)
+        else:
+            src = data_uri(image, image_mimetypes[image_format])
+        return '<img class="math" src="%s" alt="%s" />' % (src, alt_text)
+
     def visit_math(self, node):
         elem = self._render_math(
-            '$' + node['latex'] + '$',
-            node['latex'], node['image_format'])
+            self._math_latex(node), node['latex'], node['image_format'])
         if elem:
             self.body.append(elem)
         raise nodes.SkipNode
 
     def visit_displaymath(self, node):
-        if node['nowrap']:
-            latex = node['latex']
-        else:
-            latex = self._wrap_displaymath(node['latex'])
-        elem = self._render_math(latex, node['latex'], node['image_format'])
+        elem = self._render_math(
+            self._math_latex(node), node['latex'], node['image_format'])
         if elem:
             self.body.append(self.starttag(node, 'div', CLASS='math'))
             self.body.append('<p>')
@@ -215,6 +255,77 @@ class ThotHTMLTranslator(html4css1.HTMLTranslator):
         self.body.append('</a>')
 
 
+class ThotHTMLTranslator(ThotTranslatorMixin, html4css1.HTMLTranslator):
+    """Translator to HTML 4, the default."""
+
+    def __init__(self, document):
+        html4css1.HTMLTranslator.__init__(self, document)
+        self._prepare_math(document)
+
+
+class ThotHTML5Translator(ThotTranslatorMixin, html5_polyglot.HTMLTranslator):
+    """Translator to HTML 5, for setting "rst_writer: html5"."""
+
+    def __init__(self, document):
+        html5_polyglot.HTMLTranslator.__init__(self, document)
+        self._prepare_math(document)
+
+
+class ThotHTMLWriter(html4css1.Writer):
+    """
+    Writer to attach the 'translator' for additional directives.
+    """
+
+    def __init__(self):
+        html4css1.Writer.__init__(self)
+        self.translator_class = ThotHTMLTranslator
+
+
+class ThotHTML5Writer(html5_polyglot.Writer):
+    """
+    Writer to attach the 'translator' for additional directives.
+    """
+
+    def __init__(self):
+        html5_polyglot.Writer.__init__(self)
+        self.translator_class = ThotHTML5Translator
+
+
+WRITERS = {
+    'html4': ThotHTMLWriter,
+    'html5': ThotHTML5Writer,
+}
+
+# per process, by writer: (reader, parser, writer, settings)
+_components = {}
+
+def _publisher_components(writer_name):
+    """
+    The reader, parser, writer, and their default settings
+    for setting "rst_writer", which are made once and then reused.
+    """
+    if writer_name not in _components and writer_name not in WRITERS:
+        # reported once per process
+        logging.error('Unknown rst_writer "%s", use any of %s.'
+                      ' Falling back to "html4".',
+                      writer_name, ', '.join(sorted(WRITERS)))
+        _components[writer_name] = _publisher_components('html4')
+    if writer_name not in _components:
+        parser = rst.Parser()
+        reader = ThotReader(parser=parser)
+        writer = WRITERS[writer_name]()
+        publisher = Publisher(reader, parser, writer,
+                              source_class=io.StringInput,
+                              destination_class=io.StringOutput)
+        publisher.process_programmatic_settings(None, {
+            'doctitle_xform': False,
+            'initial_header_level': 2,
+        }, None)
+        _components[writer_name] = (reader, parser, writer,
+                                    publisher.settings)
+    return _components[writer_name]
+
+
 # RST setup
 roles.register_local_role('math', math_role)
 roles.register_local_role('eq', eq_role)
@@ -229,13 +340,32 @@ class RstParser(Parser):
     """
     output_ext = 'html'
     parses = ['rst']
+    version = '%s+docutils-%s+pygments-%s' % (
+        thot_version, docutils.__version__, pygments_version)
+    cacheable = True
+    cache_settings = ('latex_preamble', 'math_inline_limit', 'math_url',
+                      'rst_writer')
 
     def _parse_text(self):
-        self.text = publish_parts(
-            source=self.text,
-            settings_overrides={
-                'doctitle_xform': False,
-                'initial_header_level': 2
-            },
-            writer=ThotHTMLWriter()
-        )['fragment']
+        reader, parser, writer, defaults = _publisher_components(
+            self.settings.get('rst_writer', 'html4'))
+        settings = defaults.copy()
+        settings.math_renderer = math_renderer(self.settings)
+        settings.highlighter = highlighter(self.settings)
+        settings.math_inline_limit = self.settings.get('math_inline_limit')
+        settings.math_url = self.settings.get('math_url', default_math_url)
+        # files read by directives such as "include" and "raw"
+        settings.record_dependencies = utils.DependencyList()
+        publisher = Publisher(reader, parser, writer, settings=settings,
+                              source_class=io.StringInput,
+                              destination_class=io.StringOutput)
+        publisher.set_source(self.text)
+        publisher.set_destination()
+        publisher.publish()
+        self.text = writer.parts['fragment']
+        self.dependencies = [abspath(path) for path
+                             in settings.record_dependencies.list]
+        # parsed again once the formulas can be rendered
+        if any(image is None
+               for image in writer.visitor.math_images.values()):
+            self.is_transient = True
@@ -19,6 +19,48 @@ __all__ = [
     'TracParser',
 ]
 
+# per process, by (website_url, author_name, timezone_str)
+_environments = {}
+
+def trac_env(website_url, author_name, timezone_str):
+    """
+    Returns the Trac environment and a request for its pages,
+    which are set up once per website, author and timezone.
+    """
+    key = (website_url, author_name, timezone_str)
+    if key in _environments:
+        return _environments[key]
+
+    req = Mock(href=Href('/'),
+               abs_href=Href(website_url),
+               authname=author_name,
+               perm=MockPerm(),
+               tz=timezone_str,
+               args={})
+
+    env = EnvironmentStub(enable=['trac.*']) # + additional components
+    # -- macros support
+    env.path = ''
+    # -- intertrac support
+    env.config.set('intertrac', 'trac.title', 'Trac\'s Trac')
+    env.config.set('intertrac', 'trac.url',
+                   website_url)
+    env.config.set('intertrac', 't', 'trac')
+    env.config.set('intertrac', 'th.title', 'Trac Hacks')
+    env.config.set('intertrac', 'th.url',
+                   'http://trac-hacks.org')
+    env.config.set('intertrac', 'th.compat', 'false')
+    # -- safe schemes
+    env.config.set('wiki', 'safe_schemes',
+                   'file,ftp,http,https,svn,svn+ssh,git,'
+                   'rfc-2396.compatible,rfc-2396+under_score')
+
+    env.href = req.href
+    env.abs_href = req.abs_href
+    _environments[key] = (env, req)
+    return _environments[key]
+
+
 class TracParser(Parser):
     """
     Parser of Trac wiki pages into HTML.
@@ -30,33 +72,11 @@ class TracParser(Parser):
     parses = ['trac']
 
     def create_trac_ctx(self, website_url, author_name, timezone_str, uri):
-        req = Mock(href=Href(uri),
-                   abs_href=Href(website_url),
-                   authname=author_name,
-                   perm=MockPerm(),
-                   tz=timezone_str,
-                   args={})
-        context = Context.from_request(req, 'wiki', 'WikiStart')
-
-        env = EnvironmentStub(enable=['trac.*']) # + additional components
-        # -- macros support
-        env.path = ''
-        # -- intertrac support
-        env.config.set('intertrac', 'trac.title', 'Trac\'s Trac')
-        env.config.set('intertrac', 'trac.url',
-                       website_url)
-        env.config.set('intertrac', 't', 'trac')
-        env.config.set('intertrac', 'th.title', 'Trac Hacks')
-        env.config.set('intertrac', 'th.url',
-                       'http://trac-hacks.org')
-        env.config.set('intertrac', 'th.compat', 'false')
-        # -- safe schemes
-        env.config.set('wiki', 'safe_schemes',
-                       'file,ftp,http,https,svn,svn+ssh,git,'
-                       'rfc-2396.compatible,rfc-2396+under_score')
-
+        env, req = trac_env(website_url, author_name, timezone_str)
+        # only the page's own location differs between pages
+        req.href = Href(uri)
         env.href = req.href
-        env.abs_href = req.abs_href
+        context = Context.from_request(req, 'wiki', 'WikiStart')
         return (env, context)
 
     def _parse_text(self):
@@ -0,0 +1,148 @@
+"""Publishing of the output directory as a whole.
+
+The output directory becomes a symlink to one of several generations,
+each a complete output tree. A new one is built next to the one being
+served and replaces it by an atomic switch of the symlink.
+"""
+
+from datetime import datetime
+from os import makedirs, listdir, link, remove, rename, replace, symlink, \
+               walk
+from os.path import join, dirname, basename, exists, lexists, islink, \
+                    isdir, realpath, relpath, getmtime
+from shutil import copy2, rmtree
+import logging
+
+__all__ = [
+    'Generations',
+]
+
+GENERATION_NAME_FORMAT = '%Y%m%dT%H%M%S.%f'
+
+def link_tree(src, dst):
+    """
+    Replicates directory `src` at `dst` by hardlinks to the files in `src`,
+    which are copied if they cannot be linked.
+    """
+    for dirpath, _, filenames in walk(src):
+        target_dir = join(dst, relpath(dirpath, src))
+        if not isdir(target_dir):
+            makedirs(target_dir)
+        for filename in filenames:
+            try:
+                link(join(dirpath, filename), join(target_dir, filename))
+            except OSError:
+                copy2(join(dirpath, filename), join(target_dir, filename))
+
+
+class Generations(object):
+    """
+    Generations of an output directory, kept in a sibling directory
+    with suffix ".generations" and named after their build time.
+
+    Files are shared by hardlinks across generations, hence anything
+    written to a generation must replace files instead of altering them.
+    """
+
+    def __init__(self, output_dir, keep):
+        self.output_dir = output_dir.rstrip('/')
+        self.generations_dir = realpath(self.output_dir + '.generations')
+        self.keep = keep
+
+    def _names(self):
+        if not isdir(self.generations_dir):
+            return []
+        return sorted(listdir(self.generations_dir))
+
+    def current(self):
+        """Path of the published generation, if any."""
+        if islink(self.output_dir):
+            return realpath(self.output_dir)
+        return None
+
+    def stage(self, build_time):
+        """
+        Creates a new generation, which starts out as a replica of
+        what is currently being served, and returns its path.
+        """
+        staging = join(self.generations_dir,
+                       build_time.strftime(GENERATION_NAME_FORMAT))
+        if isdir(self.output_dir):
+            link_tree(realpath(self.output_dir), staging)
+        else:
+            makedirs(staging)
+        logging.debug('building into %s', staging)
+        return staging
+
+    def discard(self, staging):
+        """Removes a generation that is not to be published."""
+        if exists(staging) and staging != self.current():
+            rmtree(staging)
+
+    def _switch_to(self, generation):
+        tmp_link = self.output_dir + '.tmp'
+        if lexists(tmp_link):
+            remove(tmp_link)
+        symlink(relpath(generation, dirname(self.output_dir)), tmp_link)
+        replace(tmp_link, self.output_dir)
+
+    def publish(self, staging):
+        """Makes `staging` the published generation."""
+        if isdir(self.output_dir) and not islink(self.output_dir):
+            # A plain directory cannot be atomically replaced by a symlink.
+            # Once, it becomes the previous generation instead.
+            previous = join(self.generations_dir, datetime.utcfromtimestamp(
+                getmtime(self.output_dir)).strftime(GENERATION_NAME_FORMAT))
+            logging.info('Moving %s to %s.', self.output_dir, previous)
+            rename(self.output_dir, previous)
+        self._switch_to(staging)
+        self.prune()
+
+    def leave(self):
+        """
+        Turns the output directory back into a plain directory,
+        holding (hardlinks to) the files of the published generation.
+        The generations themselves are left as they are.
+        """
+        current = self.current()
+        # a symlink to elsewhere has been made by someone else
+        if current is None or dirname(current) != self.generations_dir:
+            return
+        logging.info('Replacing symlink %s by a copy of %s.',
+                     self.output_dir, current)
+        tmp_dir = self.output_dir + '.tmp'
+        if islink(tmp_dir):
+            remove(tmp_dir)
+        elif lexists(tmp_dir):
+            rmtree(tmp_dir)
+        if isdir(current):
+            link_tree(current, tmp_dir)
+        else:
+            makedirs(tmp_dir)
+        remove(self.output_dir)
+        rename(tmp_dir, self.output_dir)
+
+    def prune(self):
+        """Removes all but the `keep` most recent previous generations."""
+        current = self.current()
+        previous = [name for name in self._names()
+                    if join(self.generations_dir, name) != current]
+        for name in previous[:max(0, len(previous) - self.keep)]:
+            logging.debug('removing generation %s', name)
+            rmtree(join(self.generations_dir, name))
+
+    def rollback(self):
+        """
+        Switches back to the generation preceding the published one.
+        Returns its path, or None if there is none.
+        """
+        current = self.current()
+        names = self._names()
+        if current is None or basename(current) not in names:
+            return None
+        index = names.index(basename(current))
+        if index == 0:
+            return None
+        previous = join(self.generations_dir, names[index - 1])
+        self._switch_to(previous)
+        return previous
@@ -0,0 +1,323 @@
+"""Development server which rebuilds the site on changes.
+
+Changes are noticed by inotify (on Linux, else by polling), rebuilds are
+incremental, and browsers showing a page are told to reload it.
+"""
+
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from os import stat
+from os.path import join, isdir, isfile, abspath, realpath, relpath
+import ctypes
+import ctypes.util
+import logging
+import mimetypes
+import os
+import select
+import struct
+import threading
+import time
+import traceback
+
+from thot.discovery import IGNORE_FILE, IgnoreMatcher
+from thot.utils import walk_ignore
+
+__all__ = [
+    'Watcher', 'serve',
+]
+
+RELOAD_PATH = '/__thot_reload__'
+RELOAD_SNIPPET = (
+    '<script>new EventSource("%s").onmessage = '
+    'function() { location.reload(); };</script>' % RELOAD_PATH
+).encode('utf-8')
+
+# from <sys/inotify.h>
+IN_MODIFY = 0x002
+IN_ATTRIB = 0x004
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM \
+    | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+EVENT_HEADER = struct.Struct('iIII')
+
+try:
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    has_inotify = hasattr(libc, 'inotify_init1')
+except OSError:
+    has_inotify = False
+
+
+class Watcher(object):
+    """
+    Notices changes to files in the given directories (and below,
+    except for what thot ignores anyway) and to individual files.
+
+    `matchers` maps directories to the IgnoreMatcher to use below them,
+    which defaults to one of the patterns thot always ignores.
+    """
+
+    def __init__(self, directories, files, ignore_below=(), matchers=None):
+        self.directories = [abspath(d) for d in directories]
+        self.matchers = {abspath(d): m for d, m in (matchers or {}).items()}
+        self.files = set(abspath(f) for f in files)
+        self.ignore_below = tuple(set(
+            [abspath(d) + '/' for d in ignore_below]
+            + [realpath(d) + '/' for d in ignore_below]))
+        self.fd = None
+        self.watches = {}   # watch descriptor -> directory
+        if has_inotify:
+            self.fd = libc.inotify_init1(IN_CLOEXEC)
+            if self.fd < 0:
+                logging.warning('inotify is unavailable, polling instead.')
+                self.fd = None
+        for directory in self._all_directories():
+            self._add_watch(directory)
+        self.snapshot = self._take_snapshot() if self.fd is None else None
+
+    def _is_ignored(self, path):
+        return (abspath(path) + '/').startswith(self.ignore_below)
+
+    def _matcher(self, top):
+        if top not in self.matchers:
+            self.matchers[top] = IgnoreMatcher()
+        return self.matchers[top]
+
+    def _is_ignored_entry(self, path, is_dir=False):
+        """
+        True if `path` is below a directory to be ignored,
+        or if the matcher of the watched directory it is in ignores it.
+        """
+        if self._is_ignored(path):
+            return True
+        tops = [top for top in self.directories
+                if path.startswith(top.rstrip('/') + '/')]
+        if not tops:
+            return False
+        top = max(tops, key=len)
+        return self._matcher(top).ignores(
+            os.path.basename(path), relpath(path, top), is_dir)
+
+    def _all_directories(self):
+        dirs = set(os.path.dirname(f) for f in self.files)
+        for top in self.directories:
+            for dirpath, _, _ in walk_ignore(top, self._matcher(top)):
+                if not self._is_ignored(dirpath):
+                    dirs.add(dirpath)
+        return dirs
+
+    def _add_watch(self, directory):
+        if self.fd is None or directory in self.watches.values():
+            return
+        wd = libc.inotify_add_watch(self.fd, directory.encode('utf-8'),
+                                    WATCH_MASK)
+        if wd >= 0:
+            self.watches[wd] = directory
+
+    def _take_snapshot(self):
+        snapshot = {}
+        for f in self.files:
+            try:
+                st = stat(f)
+                snapshot[f] = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                pass
+        for top in self.directories:
+            for dirpath, _, filenames in walk_ignore(top, self._matcher(top)):
+                if self._is_ignored(dirpath):
+                    continue
+                for filename in filenames:
+                    path = join(dirpath, filename)
+                    try:
+                        st = stat(path)
+                    except OSError:
+                        continue
+                    snapshot[path] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def _read_events(self):
+        changed = set()
+        buf = os.read(self.fd, 1 << 16)
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(buf, offset)
+            offset += EVENT_HEADER.size
+            name = buf[offset:offset+length].rstrip(b'\0').decode('utf-8')
+            offset += length
+            if wd not in self.watches or not name:
+                continue
+            path = join(self.watches[wd], name)
+            if path not in self.files \
+               and self._is_ignored_entry(path, bool(mask & IN_ISDIR)):
+                continue
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self._add_watch(path)
+            changed.add(path)
+        return changed
+
+    def wait(self, settle=0.1, interval=1.0):
+        """
+        Blocks until something has changed and returns the affected paths.
+        Waits for `settle` seconds of silence, as editors and VCS tend to
+        write several files at once.
+        """
+        if self.fd is None:
+            while True:
+                time.sleep(interval)
+                snapshot = self._take_snapshot()
+                changed = set(path for path in
+                              set(snapshot) | set(self.snapshot)
+                              if snapshot.get(path) != self.snapshot.get(path))
+                self.snapshot = snapshot
+                if changed:
+                    return changed
+
+        changed = set()
+        while not changed:
+            select.select([self.fd], [], [])
+            changed |= self._read_events()
+        while select.select([self.fd], [], [], settle)[0]:
+            changed |= self._read_events()
+        return changed
+
+
+class ReloadingRequestHandler(SimpleHTTPRequestHandler):
+    """
+    Serves the output directory, prefers precompressed files if the client
+    accepts them, and adds a snippet to HTML pages that reloads them
+    once the site has been rebuilt.
+    """
+
+    # set by serve()
+    builds = None
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        logging.debug('%s - %s', self.address_string(), format % args)
+
+    def do_GET(self):
+        if self.path == RELOAD_PATH:
+            self._send_reload_events()
+            return
+        path = self.translate_path(self.path)
+        if isdir(path) and self.path.split('?', 1)[0].endswith('/'):
+            path = join(path, 'index.html')
+        if path.endswith(('.html', '.htm')) and isfile(path):
+            self._send_html(path)
+        elif 'gzip' in self.headers.get('Accept-Encoding', '') \
+             and isfile(path + '.gz'):
+            self._send_file(path + '.gz', mimetypes.guess_type(path)[0],
+                            encoding='gzip')
+        else:
+            super().do_GET()
+
+    def _send_file(self, path, content_type, encoding=None):
+        with open(path, 'rb') as f:
+            content = f.read()
+        self._send(content, content_type, encoding)
+
+    def _send(self, content, content_type, encoding=None):
+        self.send_response(200)
+        self.send_header('Content-Type',
+                         content_type or 'application/octet-stream')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(content)
+
+    def _send_html(self, path):
+        with open(path, 'rb') as f:
+            content = f.read()
+        pos = content.lower().rfind(b'</body>')
+        if pos < 0:
+            content += RELOAD_SNIPPET
+        else:
+            content = content[:pos] + RELOAD_SNIPPET + content[pos:]
+        self._send(content, 'text/html; charset=utf-8')
+
+    def _send_reload_events(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        builds = self.builds
+        with builds['changed']:
+            seen = builds['count']
+        try:
+            while True:
+                with builds['changed']:
+                    builds['changed'].wait_for(
+                        lambda: builds['count'] != seen, timeout=15)
+                    count = builds['count']
+                if count != seen:
+                    self.wfile.write(b'data: reload\n\n')
+                    seen = count
+                else:
+                    self.wfile.write(b': keep-alive\n\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+def serve(settings, rebuild, port=8000, address='127.0.0.1'):
+    """
+    Builds the site, serves its output directory,
+    and rebuilds it on every change until interrupted.
+
+    `rebuild` is called without arguments and runs a build;
+    failing builds are reported but don't stop the server.
+    """
+    builds = {'count': 0, 'changed': threading.Condition()}
+
+    def build():
+        try:
+            rebuild()
+        except (Exception, SystemExit): # pylint: disable=broad-except
+            logging.error('Build failed:\n%s', traceback.format_exc())
+            return
+        with builds['changed']:
+            builds['count'] += 1
+            builds['changed'].notify_all()
+
+    build()
+    ignore_file = join(settings['project_dir'], IGNORE_FILE)
+    matchers = {settings['project_dir']: IgnoreMatcher.from_file(ignore_file)}
+    watcher = Watcher(
+        [settings['project_dir']] + settings['template_dir'].split(','),
+        [settings['settings_path'], settings['url_path'], ignore_file],
+        ignore_below=[settings['output_dir'],
+                      settings['output_dir'] + '.generations',
+                      settings['lib_dir']],
+        matchers=matchers)
+
+    handler = partial(type('Handler', (ReloadingRequestHandler,),
+                           {'builds': builds}),
+                      directory=settings['output_dir'])
+    httpd = ThreadingHTTPServer((address, port), handler)
+    httpd.daemon_threads = True
+    server_thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    server_thread.start()
+    print('Serving %s on http://%s:%d/ - press Ctrl+C to stop.' % (
+        settings['output_dir'], address, port))
+
+    try:
+        while True:
+            changed = watcher.wait()
+            logging.info('Rebuilding after changes to: %s',
+                         ', '.join(sorted(changed)))
+            if abspath(ignore_file) in changed:
+                watcher.matchers[abspath(settings['project_dir'])] = \
+                    IgnoreMatcher.from_file(ignore_file)
+            # what is to be rebuilt is up to the incremental build
+            build()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.shutdown()
@@ -0,0 +1,139 @@
+"""Measurement of where the time of a build goes.
+"""
+
+from contextlib import contextmanager
+import json
+import os
+import time
+
+__all__ = [
+    'Timings', 'cpu_time',
+]
+
+def cpu_time():
+    """
+    CPU time, in seconds, of this process and its waited-for children,
+    which includes worker processes once their pool has been shut down.
+    """
+    t = os.times()
+    return t.user + t.system + t.children_user + t.children_system
+
+
+class Timings(object):
+    """
+    Collects wall and CPU time of the stages of a build, of every
+    invocation of a processor, and of parsing and rendering every page.
+
+    Does nothing unless enabled, so it can be used unconditionally.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.stages = []    # (name, wall, cpu) in order of occurrence
+        self.plugins = {}   # name -> [calls, wall, cpu]
+        self.pages = {}     # page path -> {'parse': (wall, cpu), ...}
+
+    @contextmanager
+    def stage(self, name):
+        if not self.enabled:
+            yield
+            return
+        wall, cpu = time.perf_counter(), cpu_time()
+        try:
+            yield
+        finally:
+            self.stages.append(
+                (name, time.perf_counter() - wall, cpu_time() - cpu))
+
+    @contextmanager
+    def plugin(self, name):
+        if not self.enabled:
+            yield
+            return
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.add_plugin(name, time.perf_counter() - wall,
+                            time.process_time() - cpu)
+
+    @contextmanager
+    def page(self, path, step):
+        if not self.enabled:
+            yield
+            return
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            self.add_page(path, step, time.perf_counter() - wall,
+                          time.process_time() - cpu)
+
+    def add_plugin(self, name, wall, cpu, calls=1):
+        totals = self.plugins.setdefault(name, [0, 0.0, 0.0])
+        totals[0] += calls
+        totals[1] += wall
+        totals[2] += cpu
+
+    def add_page(self, path, step, wall, cpu):
+        self.pages.setdefault(path, {})[step] = (wall, cpu)
+
+    def merge(self, other):
+        """
+        Adds what `other` has measured of plugins and pages,
+        such as a worker process for a page.
+        """
+        for name, (calls, wall, cpu) in other.plugins.items():
+            self.add_plugin(name, wall, cpu, calls)
+        for path, steps in other.pages.items():
+            self.pages.setdefault(path, {}).update(steps)
+
+    def slowest_pages(self, count):
+        """Paths and total wall time of the `count` slowest pages."""
+        totals = [(sum(wall for wall, _ in steps.values()), path)
+                  for path, steps in self.pages.items()]
+        totals.sort(reverse=True)
+        return [(path, wall) for wall, path in totals[:count]]
+
+    def slowest_plugins(self, count):
+        """Names and total wall time of the `count` slowest processors."""
+        totals = sorted(((wall, name) for name, (_, wall, _)
+                         in self.plugins.items()), reverse=True)
+        return [(name, wall) for wall, name in totals[:count]]
+
+    def as_dict(self):
+        return {
+            'stages': [{'name': name, 'wall': wall, 'cpu': cpu}
+                       for name, wall, cpu in self.stages],
+            'plugins': {name: {'calls': calls, 'wall': wall, 'cpu': cpu}
+                        for name, (calls, wall, cpu)
+                        in self.plugins.items()},
+            'pages': {path: {step: {'wall': wall, 'cpu': cpu}
+                             for step, (wall, cpu) in steps.items()}
+                      for path, steps in self.pages.items()},
+        }
+
+    def save(self, path, **extra):
+        """Writes all measurements, and `extra`, to `path` as JSON."""
+        data = dict(extra)
+        data.update(self.as_dict())
+        with open(path + '.tmp', 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(path + '.tmp', path)
+
+    def report(self, count):
+        """Returns a summary for humans, naming the `count` slowest items."""
+        lines = ['%-40s %8s %8s' % ('Stages:', 'wall s', 'cpu s')]
+        for name, wall, cpu in self.stages:
+            lines.append('  %-38s %8.3f %8.3f' % (name, wall, cpu))
+        if self.plugins:
+            lines.append('%-40s %8s %8s' % (
+                'Slowest processors:', 'wall s', 'calls'))
+            for name, wall in self.slowest_plugins(count):
+                lines.append('  %-38s %8.3f %8d' % (
+                    name, wall, self.plugins[name][0]))
+        if self.pages:
+            lines.append('%-40s %8s' % ('Slowest pages:', 'wall s'))
+            for path, wall in self.slowest_pages(count):
+                lines.append('  %-38s %8.3f' % (path, wall))
+        return '\n'.join(lines)
@@ -1,18 +1,18 @@
 """Legacy collection of functions that need to be filed elsewhere.
 """
 
-from fnmatch import fnmatch
-from glob import glob
-from subprocess import Popen, PIPE
-from tempfile import mkstemp, gettempdir
+from tempfile import mkstemp
 import base64
-import errno
 import hashlib
 import logging
 import mimetypes
 import os
 import shutil
 
+from thot.discovery import scan_tree
+from thot.latex import MathRenderer, supported_image_formats, \
+    default_image_format
+
 try:
     import murmur
     has_murmur = True
@@ -21,9 +21,10 @@ except ModuleNotFoundError:
 
 __all__ = [
     'ordinal_suffix', 'datetimeformat', 'walk_ignore', 'get_hash_from_path',
-    'equivalent_files', 'copy_file', 'partition',
+    'hash_file', 'equivalent_files', 'file_has_content', 'copy_file',
+    'partition',
     'supported_image_formats', 'default_image_format', 'render_latex_to_image',
-    'embed_image',
+    'data_uri', 'embed_image',
 ]
 
 def ordinal_suffix(day):
@@ -59,24 +60,25 @@ if os.name == 'nt':
     os.link = create_hard_link_windows
 
 
-def walk_ignore(path):
+def walk_ignore(path, matcher=None):
     """Custom walker that ignores specific filenames."""
-    ignores = ('.*', '*~', '#*', '_*',)
-    for dirpath, dirnames, filenames in os.walk(path):
-        for pattern in ignores:
-            filenames[:] = [n for n in filenames if not fnmatch(n, pattern)]
-            dirnames[:] = [n for n in dirnames if not fnmatch(n, pattern)]
-        yield dirpath, dirnames, filenames
+    for dirpath, dirs, files in scan_tree(path, matcher):
+        yield dirpath, [d.name for d in dirs], [f.name for f in files]
 
 def get_hash_from_path(path, algorithm='sha1'):
     """Returns the hash of the file `path`."""
-    f = open(path)
-    content = f.read()
-    f.close()
     m = hashlib.new(algorithm)
-    m.update(content)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            m.update(chunk)
     return m.hexdigest()
 
+def hash_file(path):
+    """Returns a digest of the content of file `path`, by murmur if available."""
+    if has_murmur:
+        return murmur.file_hash(path)
+    return get_hash_from_path(path)
+
 def equivalent_files(src, dst):
     """True if `src` and `dst` are the equivalent."""
     # Same inode on same device <=> thus identical?
@@ -84,10 +86,24 @@ def equivalent_files(src, dst):
     if src_stat.st_dev == dst_stat.st_dev \
        and src_stat.st_ino == dst_stat.st_ino:
         return True
+    # Files of different sizes cannot be.
+    if src_stat.st_size != dst_stat.st_size:
+        return False
+    # A copy made by copy_file() retains size and mtime.
+    if src_stat.st_mtime_ns == dst_stat.st_mtime_ns:
+        return True
     # Else, same file content?
-    else:
-        file_hash = murmur.file_hash if has_murmur else get_hash_from_path
-        return file_hash(src) == file_hash(dst)
+    return hash_file(src) == hash_file(dst)
+
+def file_has_content(path, content):
+    """True if the file at `path` consists of `content` (as bytes)."""
+    try:
+        if os.path.getsize(path) != len(content):
+            return False
+        with open(path, 'rb') as f:
+            return f.read() == content
+    except OSError:
+        return False
 
 def copy_file(src, dst, hardlinks=False):
     """
@@ -110,6 +126,8 @@ def copy_file(src, dst, hardlinks=False):
     if os.path.isfile(dst):
         if equivalent_files(src, dst):
             return False
+        # Don't write into `dst`, which can be a hardlink to another file.
+        os.remove(dst)
     try:
         if hardlinks:
             try:
@@ -137,99 +155,34 @@ def partition(alist, indices):
 ### output- and format-related helper
 ################################################################################
 
-DOC_HEAD = r'''
-\documentclass[12pt]{article}
-\usepackage[utf8x]{inputenc}
-\usepackage{amsmath}
-\usepackage{amsthm}
-\usepackage{amssymb}
-\usepackage{amsfonts}
-\usepackage{bm}
-\pagestyle{empty}
-'''
-
-DOC_BODY = r'''
-\begin{document}
-%s
-\end{document}
-'''
-
-supported_image_formats = ('svg', 'png')
-default_image_format = 'png'
 def render_latex_to_image(math, image_format='png'):
     """
-    Renders the given formula (in LaTeX markup) to an image.
+    Renders the given formula (in LaTeX markup) to an image,
+    and returns the path of a temporary file with it, or None.
 
     - format png requires dvipng
     - format svg needs dvisvgm
 
     @param image_format can be any of: svg, png
     """
-    # generate an input file
-    latex = DOC_HEAD + DOC_BODY % math
-    _, latex_filename = mkstemp(suffix='.tex')
-    with open(latex_filename, 'wb') as latex_file:
-        latex_file.write(latex)
-
-    # call latex and friends
-    latex_cmdline = [
-        'latex', '--interaction=nonstopmode', latex_filename
-    ]
-    dvi_converter_cmdline = {
-        'png': [
-            'dvipng',
-            '-o', latex_filename.replace('.tex', '.png'),
-            '-T', 'tight',
-            '-bg', 'Transparent',
-            '-z9',
-            latex_filename.replace('.tex', '.dvi'),
-        ],
-        'svg': [
-            'dvisvgm',
-            '--no-styles', '--no-fonts', # or what IE 10 will display is a mess
-            latex_filename.replace('.tex', '.dvi'),
-        ],
-    }
-
-    curdir = os.getcwd()
-    os.chdir(gettempdir())
-
-    try:
-        for cmdline, cmdref in [
-                (latex_cmdline, 'LaTeX'),
-                (dvi_converter_cmdline[image_format], 'dvipng'),
-            ]:
-            try:
-                p = Popen(cmdline, stdout=PIPE, stderr=PIPE)
-            except OSError as err:
-                if err.errno != errno.ENOENT: # no such file or directory
-                    raise
-                logging.error(
-                    '%s command cannot be run, but is needed for math markup.',
-                    cmdref)
-                return None
-
-            stdout, stderr = p.communicate()
-            if p.returncode != 0:
-                logging.error(
-                    '%s exited with error: \n[stderr]\n%s\n[stdout]\n%s',
-                    cmdref, stderr, stdout)
-                return None
-    finally:
-        # Above has generated a surplus of files that are not needed.
-        for filename in glob(latex_filename[0:-4] + '*'):
-            if not filename.endswith('.'+image_format):
-                os.remove(filename)
-        os.chdir(curdir)
-
-    # return the path of the PNG
-    return latex_filename.replace('.tex', '.'+image_format)
+    image = MathRenderer().render([math], image_format)[math]
+    if image is None:
+        return None
+    fd, image_path = mkstemp(suffix='.'+image_format)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(image)
+    return image_path
+
+def data_uri(content, mimetype):
+    """
+    Returns a Data URI string of `content` (bytes) for embedding in HTML or CSS.
+    """
+    return ''.join(['data:', mimetype, ';base64,',
+                    base64.b64encode(content).decode('ascii')])
 
 def embed_image(image_path):
     """
     Returns a Data URI string of the image for embedding in HTML or CSS.
     """
-    mimetype = mimetypes.guess_type(image_path)[0]
-    b64img = base64.encodestring(open(image_path, 'rb').read())\
-        .replace('\n', '')
-    return ''.join(['data:', mimetype, ';base64,', b64img])
+    with open(image_path, 'rb') as f:
+        return data_uri(f.read(), mimetypes.guess_type(image_path)[0])